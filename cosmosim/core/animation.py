@@ -1,20 +1,108 @@
 import cosmosim.util.functions as F
 import os
-import pickle
-import pygame
+from cosmosim.core.trajectory import read_states
+from cosmosim.core.pyramid import Pyramid
+from cosmosim.core.framebus import FrameBus
+from cosmosim.core.stream import RemoteFrames, Viewport
+from cosmosim.util.trails import Trails
+import itertools
+import threading
+import queue
+import copy
 import numpy as np
 import datetime
-from tqdm import tqdm
-from matplotlib import pyplot as plt
-from matplotlib.animation import FuncAnimation, writers
+from cosmosim.util.progress import progress_bar
+
+# pygame and matplotlib are imported by the methods that draw, so that
+# loading saved runs doesn't pull in a display stack
 
 WHITE = (255,255,255)
 YELLOW = (255,255,0)
 BLACK = (0,0,0)
+
+
+class Prefetcher:
+    # Decodes saved frames on a background thread, keeping up to `window` of
+    # them ready ahead of the playhead. Cycles through the run; iterating 
+    # over it yields one pass.
+    
+    def __init__(self, path, window=64):
+        self.path = path
+        self.queue = queue.Queue(maxsize=window)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+        
+    def fill(self):
+        while not self.stopped.is_set():
+            for state in read_states(self.path):
+                if not self.put(state):
+                    return
+            # End of a pass
+            if not self.put(None):
+                return
+            
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def __iter__(self):
+        while True:
+            state = self.queue.get()
+            if state is None:
+                return
+            yield state
+            
+    def stop(self):
+        self.stopped.set()
+        
+        
+class Interpolator:
+    # Smooth in-between frames from two stored frames, by cubic Hermite 
+    # interpolation of the positions using the stored velocities. Bodies 
+    # gone by the second frame coast on in a straight line.
+    
+    def __init__(self, a, b):
+        self.a = a
+        self.T = (b.iteration - a.iteration)*a.dt
+        order = np.argsort(b.ids)
+        loc = np.searchsorted(b.ids[order], a.ids).clip(0, max(len(b) - 1, 0))
+        self.matched = np.zeros(len(a), dtype=bool)
+        if len(b):
+            self.matched = b.ids[order][loc] == a.ids
+        k = order[loc[self.matched]]
+        self.p1, self.v1 = b.position[k], b.velocity[k]
+        
+    def at(self, s):
+        a, m = self.a, self.matched
+        frame = copy.copy(a)
+        frame.position = a.position + a.velocity*s*self.T
+        frame.position[m] = F.hermite(a.position[m], a.velocity[m], self.p1, 
+                                      self.v1, self.T, s)
+        frame.iteration = a.iteration + s*(self.T/a.dt)
+        return frame
+    
           
 class InteractiveAnimation:
     
-    def __init__(self, data, width=1600, height=1000, fps=60, scale=1.3e-6):
+    def __init__(self, data, width=1600, height=1000, fps=60, scale=1.3e-6,
+                 lazy=False, window=64, interpolate=1, trails=False, 
+                 trail_length=200, pyramid=None):
+        # lazy: stream frames from disk on a background thread instead of 
+        #       loading the whole run up front
+        # interpolate: frames shown per stored frame, the rest interpolated
+        # trails: draw each body's last trail_length frames (toggle with T)
+        # pyramid: directory built by cosmosim.core.pyramid (True for 
+        #          data/pyramid); playback then picks a level by zoom and 
+        #          speed, with UP/DOWN for speed and LEFT/RIGHT to scrub
+        # data may also be a FrameBus, to watch a run as it is computed, or
+        # the "tcp://host:port" of a cosmosim.core.stream server, which then
+        # only sends the bodies on screen
         self.width = width
         self.height = height
         self.fps = fps
@@ -29,35 +117,70 @@ class InteractiveAnimation:
             "origin":np.array([self.width/2,self.height/2])
         }
         
-        if isinstance(data, str):
-            self.states = []
-            path = data
-            self.filelist = os.listdir(path)
-            for i in tqdm(self.filelist, desc="Loading data"):
-                with open(path + i, 'rb') as f:
-                    while True:
-                        try:
-                            state = pickle.load(f)
-                            self.states.append(state)
-                        except EOFError:
-                            break
+        self.interpolate = interpolate
+        self.window = window
+        self.prefetcher = None
+        self.show_trails = trails
+        # Kept in 3D and keyed by body id, so trails follow the camera 
+        self.trails = Trails(trail_length, dims=3)
+        
+        self.pyramid = None
+        self.bus = None
+        self.remote = None
+        self.viewport = None
+        self.speed = 1
+        self.frame = 0.0
+        if pyramid:
+            if pyramid is True:
+                pyramid = os.path.join(data, "pyramid")
+            self.pyramid = Pyramid(pyramid)
+        
+        if isinstance(data, str) and data.startswith("tcp://"):
+            data = RemoteFrames(data)
+        if isinstance(data, RemoteFrames):
+            self.remote = data
+            self.update_viewport()
+        if isinstance(data, (FrameBus, RemoteFrames)):
+            self.bus = data
+            self.states = None
+            self.frames = "live"
+            self.dt = None
+        elif self.pyramid and isinstance(data, str):
+            # Full-resolution frames are read on demand through the index
+            self.states = None
+            self.frames = self.pyramid.frames
+            self.dt = self.pyramid.dt
+        elif isinstance(data, str) and lazy:
+            self.path = data
+            self.states = None
+            self.frames = "?"
+            self.dt = next(read_states(data)).dt
         else:
-            self.states = data
-            
-        self.frames = len(self.states)
-        self.dt = self.states[0].dt
+            if isinstance(data, str):
+                self.states = list(progress_bar(read_states(data), desc="Loading data"))
+            else:
+                self.states = data
+            self.frames = len(self.states)
+            self.dt = self.states[0].dt
+        self.time = 0.0
                     
     def draw(self, state):
-        objects = state.objects
+        import pygame
         scale = self.context['scale']
-        for obj in objects:
-            radius = max(1, int(obj.get_radius()*scale))
-            q = F.screen_coordinates_3d(obj.position, **self.context)
-            if self.onscreen(q):
-                pygame.draw.circle(self.screen, obj.color, q.astype(int), radius)
+        radii = np.maximum(1, (state.radii()*scale).astype(int))
+        camera = F.camera(**self.context)
+        if self.show_trails:
+            self.trails.draw(self.screen, camera, state.ids, state.colors())
+        q = F.project(state.positions(), camera)
+        visible = self.onscreen(q)
+        for center, radius, color in zip(q[visible].astype(int).tolist(), 
+                                         radii[visible].tolist(), 
+                                         state.colors()[visible].tolist()):
+            pygame.draw.circle(self.screen, color, center, radius)
     
             
     def handle_user_input(self, event):
+        import pygame
         # Stop simulation when user quits
         if event.type == pygame.QUIT:
             print("Quitting...")
@@ -76,6 +199,20 @@ class InteractiveAnimation:
                 self.context['offset'] += np.array([0,-50])/self.context['scale']
             elif event.key == pygame.K_d:
                 self.context['offset'] += np.array([-50,00])/self.context['scale']
+            # UP/DOWN change the playback speed, LEFT/RIGHT skip through
+            # the run (with a pyramid)
+            elif event.key == pygame.K_UP:
+                self.speed *= 2
+            elif event.key == pygame.K_DOWN:
+                self.speed = max(1, self.speed//2)
+            elif event.key == pygame.K_RIGHT and self.pyramid:
+                self.frame = (self.frame + 0.05*self.frames) % self.frames
+            elif event.key == pygame.K_LEFT and self.pyramid:
+                self.frame = (self.frame - 0.05*self.frames) % self.frames
+            # T toggles trails
+            elif event.key == pygame.K_t:
+                self.show_trails = not self.show_trails
+                self.trails.reset()
         elif event.type == pygame.MOUSEWHEEL:
             # Wheel up zooms in 5%
             if event.y > 0:
@@ -107,9 +244,18 @@ class InteractiveAnimation:
         else:
             pass
         
+    def update_viewport(self):
+        # Tell a stream server what is on screen whenever the camera moves
+        camera = F.camera(**self.context)
+        if self.viewport is None or not (np.array_equal(camera[0], self.viewport.matrix)
+                                         and np.array_equal(camera[1], self.viewport.shift)):
+            self.viewport = Viewport.from_camera(camera, self.width, self.height)
+            self.remote.set_viewport(self.viewport)
+        
     def onscreen(self, coordinates):
-        x, y = coordinates
-        return (x >= 0 and x <= self.width and y >= 0 and y <= self.height)
+        # One bool per row of an (n, 2) array
+        x, y = np.asarray(coordinates).T
+        return (x >= 0) & (x <= self.width) & (y >= 0) & (y <= self.height)
         
             
     def update_simulation_text(self):
@@ -130,7 +276,7 @@ class InteractiveAnimation:
         iterations_img = self.font.render(iterations_text, True, WHITE)
         self.screen.blit(iterations_img, (self.width*0.85, 60))
         # Update elapsed time
-        elapsed_time = iterations*self.dt
+        elapsed_time = self.time
         elapsed_time_formatted = str(datetime.timedelta(seconds=elapsed_time))
         elapsed_time_text = f"Elapsed time: {elapsed_time_formatted}"
         elapsed_time_img = self.font.render(elapsed_time_text, True, WHITE)
@@ -142,6 +288,7 @@ class InteractiveAnimation:
             self.screen.blit(paused_img, (self.width*0.48, 20))
             
     def play(self, paused=False):
+        import pygame
         pygame.init()
         pygame.display.set_caption('cosmosim 0.10')
         self.clock = pygame.time.Clock()
@@ -151,31 +298,95 @@ class InteractiveAnimation:
         self.running = True
         self.iterations = 0
         self.paused = paused
-        while self.running:
-            for state in self.states:
-                new_state = True
-                while self.running and (self.paused or new_state):
-                    # Clear the screen
-                    self.screen.fill(BLACK)
-                    # Handle user inputs
-                    for event in pygame.event.get():
-                        self.handle_user_input(event)
-                    # Draw
-                    self.draw(state)
-                    # Update simulation text
-                    self.update_simulation_text()
-                    # Refresh display
-                    pygame.display.flip()
-                    self.clock.tick(self.fps)
-                    new_state = False
+        if self.pyramid:
+            self.play_pyramid()
+        elif self.states is None and self.bus is None:
+            self.prefetcher = Prefetcher(self.path, self.window)
+        while self.running and not self.pyramid:
+            previous = None
+            self.trails.reset()
+            for state in self.source():
+                if previous is not None and self.interpolate > 1:
+                    interpolator = Interpolator(previous, state)
+                    for k in range(1, self.interpolate):
+                        if not self.running:
+                            break
+                        self.show(interpolator.at(k/self.interpolate))
+                self.show(state)
                 self.iterations += 1
+                previous = state
+                if not self.running:
+                    break
+            if self.bus is not None:
+                # The run is over: hold its last frame until the window closes
+                if previous is not None and self.running:
+                    self.paused = True
+                    self.show(previous)
+                break
             self.iterations = 0
+        if self.prefetcher:
+            self.prefetcher.stop()
+        if self.remote:
+            self.remote.close()
         pygame.quit()
         
+    def source(self):
+        # Frames for one pass of playback
+        if self.states is not None:
+            return self.states
+        if self.bus is not None:
+            # Detached, since paused and interpolated frames are held while
+            # the publisher reuses their slots
+            return self.bus.frames(copy=True)
+        return self.prefetcher
+        
+    def play_pyramid(self):
+        # Step through the run speed frames at a time, each shown frame 
+        # taken from the coarsest level that still looks the same
+        while self.running:
+            self.level = self.pyramid.level_for(self.speed, self.context['scale'])
+            k = int(self.frame)
+            if self.level == 0 and self.states is not None:
+                state = self.states[k]
+            else:
+                state = self.pyramid.frame(self.level, k)
+            self.iterations = k
+            self.show(state)
+            self.frame = (self.frame + self.speed) % self.frames
+            if self.frame < self.speed:
+                self.trails.reset()
+        
+    def show(self, state):
+        # Draw one frame, and keep redrawing it while paused
+        import pygame
+        new_state = True
+        self.time = state.iteration*state.dt
+        if self.show_trails:
+            # Only real bodies have trails, not aggregated cells
+            real = state.ids >= 0
+            self.trails.record(state.ids[real], state.position[real])
+        while self.running and (self.paused or new_state):
+            # Clear the screen
+            self.screen.fill(BLACK)
+            # Handle user inputs
+            for event in pygame.event.get():
+                self.handle_user_input(event)
+            if self.remote:
+                self.update_viewport()
+            # Draw
+            self.draw(state)
+            # Update simulation text
+            self.update_simulation_text()
+            # Refresh display
+            pygame.display.flip()
+            self.clock.tick(self.fps)
+            new_state = False
+        
 
 class MP4Animation:
     
     def __init__(self, data, width=1000, height=1000, fps=60, scale=1.3e-6, n_frames=None):
+        from matplotlib import pyplot as plt
         self.width = width
         self.height = height
         self.fps = fps
@@ -190,25 +401,19 @@ class MP4Animation:
             "origin":np.array([self.width/2,self.height/2])
         }
         
-        if isinstance(data, str):
-            self.states = []
-            path = data
-            self.filelist = os.listdir(path)
-            loaded_frames = 0
-            for i in tqdm(self.filelist, desc="Loading data"):
-                with open(path + i, 'rb') as f:
-                    while (not n_frames or loaded_frames < n_frames):
-                        try:
-                            state = pickle.load(f)
-                            self.states.append(state)
-                            loaded_frames += 1
-                        except EOFError:
-                            break
+        if isinstance(data, (str, FrameBus)):
+            # From a bus, frames are collected as they are published, until 
+            # n_frames or the end of the run
+            states = read_states(data) if isinstance(data, str) else data.frames(copy=True)
+            if n_frames:
+                states = itertools.islice(states, n_frames)
+            self.states = list(progress_bar(states, desc="Loading data", total=n_frames))
         else:
             self.states = data
             
         self.frames = n_frames or len(self.states)
         self.dt = self.states[0].dt
+        self.time = 0.0
         px = 1/plt.rcParams['figure.dpi']  # pixel in inches
         figsize=(self.width*px, self.height*px, )
         self.fig = plt.figure(figsize=figsize)
@@ -232,7 +437,7 @@ class MP4Animation:
         frames = self.frames
         iterations_text = f"Frame: {iterations}/{frames}"
         # Update elapsed time
-        elapsed_time = iterations*self.dt
+        elapsed_time = self.time
         elapsed_time_formatted = str(datetime.timedelta(seconds=elapsed_time))
         elapsed_time_text = f"Elapsed time: {elapsed_time_formatted}"
         
@@ -246,10 +451,11 @@ class MP4Animation:
     def animate(self, i):
         print(f"Rendering frame: {i+1}/{self.frames}")
         state = self.states[i]
+        self.time = state.iteration*state.dt
         scale = self.context['scale']
-        positions = [F.screen_coordinates_3d(p, **self.context) for p in state.positions()]
-        radii = [max(1, int(r*scale)) for r in state.radii()]
-        colors = [(c[0]/255, c[1]/255, c[2]/255) for c in state.colors()]
+        positions = F.project(state.positions(), F.camera(**self.context))
+        radii = np.maximum(1, (state.radii()*scale).astype(int))
+        colors = state.colors()/255
         self.space.set_offsets(positions)
         self.space.set_sizes(radii)
         self.space.set_edgecolors(colors)
@@ -258,6 +464,7 @@ class MP4Animation:
         return self.space, self.text
     
     def run(self):
+        from matplotlib.animation import FuncAnimation, writers
         writer = writers['ffmpeg']
         writer = writer(fps=30, metadata=dict(artist='Me'), bitrate=1800)
         anim = FuncAnimation(self.fig, 
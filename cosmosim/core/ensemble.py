@@ -0,0 +1,131 @@
+import numpy as np
+import os
+import json
+import time
+import itertools
+import functools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from cosmosim.util.progress import progress_bar
+from cosmosim.util.direct import acc_batched
+
+# =============================================================================
+# Ensembles of universes: the same setup over many seeds, masses or time
+# steps. Members are given as Universes or as picklable callables that build
+# one (module-level functions, or the partials made by sweep). Each member's
+# summary metrics are collected into one results index.
+# =============================================================================
+
+def bodies(state):
+    return len(state)
+
+def total_mass(state):
+    return float(state.mass.sum())
+
+def momentum(state):
+    return float(np.linalg.norm(np.sum(state.mass[:,None]*state.velocity, axis=0)))
+
+def escaped(state):
+    return len(state.escaped)
+
+DEFAULT_METRICS = {
+    "bodies": bodies,
+    "total_mass": total_mass,
+    "momentum": momentum,
+    "escaped": escaped,
+}
+
+def sweep(setup, **grid):
+    # One member per combination of the parameter values, e.g.
+    # sweep(make_universe, seed=range(100), dt=[60, 600])
+    names = list(grid)
+    return [functools.partial(setup, **dict(zip(names, values)))
+            for values in itertools.product(*grid.values())]
+
+def _run_member(run, setup, outpath, metrics):
+    start = time.perf_counter()
+    result = {"run": run, "params": getattr(setup, "keywords", {})}
+    try:
+        universe = setup() if callable(setup) else setup
+        if outpath:
+            universe.outpath = os.path.join(outpath, f"run_{run}/")
+            universe.run(progress=False)
+            result["outpath"] = universe.outpath
+        else:
+            universe.run(progress=False, record=False)
+        result.update({name: f(universe.state) for name, f in metrics.items()})
+        result["status"] = "ok"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = repr(e)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+class Ensemble:
+
+    def __init__(self, members, outpath=None, processes=None, metrics=None):
+        self.members = members
+        self.outpath = outpath
+        self.processes = processes
+        self.metrics = metrics or DEFAULT_METRICS
+        self.results = []
+
+    def run(self, progress=True):
+        # One member per task on a pool of worker processes, which import
+        # cosmosim once each rather than once per run
+        if self.outpath:
+            os.makedirs(self.outpath, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            futures = [pool.submit(_run_member, run, setup, self.outpath, self.metrics)
+                       for run, setup in enumerate(self.members)]
+            completed = progress_bar(as_completed(futures), total=len(futures),
+                                     desc="Running ensemble", disable=not progress)
+            results = [f.result() for f in completed]
+        self.results = sorted(results, key=lambda r: r["run"])
+        self.save_index()
+        return self.results
+
+    def run_batched(self, progress=True):
+        # Advance all members together with one vectorized kernel over an
+        # extra batch dimension. Members must have the same number of bodies
+        # and iterations; collisions, escapes and the other per-body stages
+        # are not applied, so this is for many small, collisionless systems.
+        start = time.perf_counter()
+        universes = [setup() if callable(setup) else setup for setup in self.members]
+        states = [u.state for u in universes]
+        if len({len(s) for s in states}) > 1:
+            raise ValueError("Batched members must all have the same number of bodies")
+        if len({u.iterations for u in universes}) > 1:
+            raise ValueError("Batched members must all run for the same number of iterations")
+        p = np.stack([s.position for s in states])
+        v = np.stack([s.velocity for s in states])
+        # Test particles simply get no pull
+        m = np.stack([np.where(s.test, 0.0, s.mass) for s in states])
+        G = np.array([s.G for s in states])
+        dt = np.array([s.dt for s in states])[:,None,None]
+        for i in progress_bar(range(universes[0].iterations), desc="Running batch",
+                              disable=not progress):
+            a = acc_batched(p, m, G)
+            for b, s in enumerate(states):
+                for potential in s.potentials:
+                    a[b] += potential.acceleration(p[b], s.G)
+            v += a*dt
+            p += v*dt
+        seconds = (time.perf_counter() - start)/len(states)
+        self.results = []
+        for run, (setup, universe, state) in enumerate(zip(self.members, universes, states)):
+            state.position = p[run].copy()
+            state.velocity = v[run].copy()
+            state.iteration += universe.iterations
+            result = {"run": run, "params": getattr(setup, "keywords", {})}
+            result.update({name: f(state) for name, f in self.metrics.items()})
+            result.update(status="ok", seconds=seconds)
+            self.results.append(result)
+        self.save_index()
+        return self.results
+
+    def save_index(self):
+        if self.outpath:
+            os.makedirs(self.outpath, exist_ok=True)
+            with open(os.path.join(self.outpath, "index.json"), "w") as f:
+                json.dump(self.results, f, indent=2, default=str)
@@ -0,0 +1,77 @@
+import numpy as np
+import os
+
+# =============================================================================
+# Merger events. State.absorb records one row per merger, and an EventLog
+# appends them to one raw binary file per column, so a run's merger
+# statistics come from a small file rather than from replaying its frames.
+# =============================================================================
+
+# name: (dtype, values per row)
+MERGE_COLUMNS = {
+    "iteration": (np.int64, 1),
+    "time": (np.float64, 1),                # Fraction of the step at contact
+    "survivor": (np.int64, 1),              # Body ids
+    "absorbed": (np.int64, 1),
+    "survivor_mass": (np.float64, 1),       # Masses before the merger
+    "absorbed_mass": (np.float64, 1),
+    "survivor_position": (np.float64, 3),
+    "absorbed_position": (np.float64, 3),
+    "relative_velocity": (np.float64, 3),   # Absorbed relative to survivor
+}
+
+def column_path(path, name):
+    return os.path.join(path, f"{name}.bin")
+
+def to_columns(events):
+    # Rows (tuples in MERGE_COLUMNS order) to {name: array}
+    columns = {}
+    for k, (name, (dtype, width)) in enumerate(MERGE_COLUMNS.items()):
+        values = np.array([e[k] for e in events], dtype=dtype)
+        columns[name] = values.reshape(-1, width) if width > 1 else values
+    return columns
+
+
+class EventLog:
+
+    def __init__(self, path=None, clear=True):
+        # Without a path the events are only kept in memory
+        self.path = path
+        self.rows = []
+        if path:
+            os.makedirs(path, exist_ok=True)
+            if clear:
+                for name in MERGE_COLUMNS:
+                    if os.path.isfile(column_path(path, name)):
+                        os.remove(column_path(path, name))
+
+    def __len__(self):
+        if self.path:
+            return read_events(self.path)["iteration"].size
+        return len(self.rows)
+
+    def append(self, events):
+        if not events:
+            return
+        if not self.path:
+            self.rows.extend(events)
+            return
+        for name, values in to_columns(events).items():
+            with open(column_path(self.path, name), "ab") as f:
+                values.tofile(f)
+
+    def columns(self):
+        if self.path:
+            return read_events(self.path)
+        return to_columns(self.rows)
+
+
+def read_events(path, columns=None):
+    # {name: array} for the requested (default all) columns of an event log
+    out = {}
+    for name in columns or MERGE_COLUMNS:
+        dtype, width = MERGE_COLUMNS[name]
+        filename = column_path(path, name)
+        values = np.fromfile(filename, dtype=dtype) if os.path.isfile(filename) else np.zeros(0, dtype=dtype)
+        out[name] = values.reshape(-1, width) if width > 1 else values
+    return out
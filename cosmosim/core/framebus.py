@@ -0,0 +1,213 @@
+import numpy as np
+import time
+from multiprocessing import shared_memory
+
+# =============================================================================
+# Shared-memory frame bus. A running simulation publishes each recorded
+# frame into a ring of slots in one shared memory block, and any number of
+# local processes (the player, an MP4 exporter, a metrics sampler) attach to
+# it by name and read the frames in place, without pickling or copying.
+#
+#   header   int64[4]   slots, capacity, latest generation, finished flag
+#   slot k   int64[4]   generation, iteration, n, dt (as float64)
+#            per body   ids, mass, radius, position, velocity, color
+#
+# Frame g lives in slot g % slots. The publisher marks a slot -1 while
+# rewriting it, so a reader can tell a frame is still intact by checking the
+# slot's generation afterwards (BusFrame.valid). Readers that fall more than
+# slots - 1 frames behind skip ahead.
+# =============================================================================
+
+SLOT_FIELDS = (     # name, dtype, values per body
+    ("ids", np.int64, 1),
+    ("mass", np.float64, 1),
+    ("radius", np.float64, 1),
+    ("position", np.float64, 3),
+    ("velocity", np.float64, 3),
+    ("color", np.uint8, 3),
+)
+HEADER = 4
+SLOT_HEADER = 4
+
+def _slot_bytes(capacity):
+    size = 8*SLOT_HEADER + sum(np.dtype(dtype).itemsize*width*capacity
+                               for _, dtype, width in SLOT_FIELDS)
+    return -(-size//8)*8
+
+def _attach(name):
+    # Before Python 3.13 attaching also registers the block with the
+    # process's resource tracker, which unlinks it when the process exits.
+    # A tracker inherited from the publisher (forked readers) already knows
+    # the block and must keep it, so only a tracker of our own is told to
+    # forget it.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    from multiprocessing import resource_tracker
+    own_tracker = getattr(resource_tracker._resource_tracker, "_fd", None) is None
+    shm = shared_memory.SharedMemory(name=name)
+    if own_tracker:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class BusFrame:
+    # One frame on the bus, State-like enough for the players and metrics.
+    # The arrays are read-only views into shared memory until copy()
+
+    def __init__(self, generation, iteration, dt, fields, slot_header=None):
+        self.generation = generation
+        self.iteration = iteration
+        self.dt = dt
+        self.ids = fields["ids"]
+        self.mass = fields["mass"]
+        self.radius = fields["radius"]
+        self.position = fields["position"]
+        self.velocity = fields["velocity"]
+        self.color = fields["color"]
+        self.slot_header = slot_header
+
+    def __len__(self):
+        return self.ids.size
+
+    def valid(self):
+        # False once the publisher has started overwriting this frame
+        return self.slot_header is None or self.slot_header[0] == self.generation
+
+    def copy(self):
+        fields = {name: np.array(getattr(self, name)) for name, _, _ in SLOT_FIELDS}
+        return BusFrame(self.generation, self.iteration, self.dt, fields)
+
+    def masses(self):
+        return self.mass
+
+    def radii(self):
+        return self.radius
+
+    def positions(self):
+        return self.position
+
+    def velocities(self):
+        return self.velocity
+
+    def colors(self):
+        return self.color
+
+
+class FrameBus:
+
+    def __init__(self, name=None, capacity=None, slots=8, create=True):
+        # Publisher: FrameBus(capacity=max bodies); readers: FrameBus.attach(name)
+        if create:
+            if capacity is None:
+                raise ValueError("A new frame bus needs a capacity in bodies")
+            size = 8*HEADER + slots*_slot_bytes(capacity)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            np.ndarray(HEADER, np.int64, self.shm.buf)[:] = [slots, capacity, -1, 0]
+        else:
+            self.shm = _attach(name)
+        self.owner = create
+        self.header = np.ndarray(HEADER, np.int64, self.shm.buf)
+        self.slots, self.capacity = int(self.header[0]), int(self.header[1])
+        self.views = [self._slot(k) for k in range(self.slots)]
+
+    @classmethod
+    def attach(cls, name):
+        return cls(name, create=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _slot(self, k):
+        offset = 8*HEADER + k*_slot_bytes(self.capacity)
+        head = np.ndarray(SLOT_HEADER, np.int64, self.shm.buf, offset)
+        dt = np.ndarray(1, np.float64, self.shm.buf, offset + 8*(SLOT_HEADER - 1))
+        offset += 8*SLOT_HEADER
+        fields = {}
+        for name, dtype, width in SLOT_FIELDS:
+            shape = (self.capacity, width) if width > 1 else (self.capacity,)
+            fields[name] = np.ndarray(shape, dtype, self.shm.buf, offset)
+            offset += np.dtype(dtype).itemsize*width*self.capacity
+            if not self.owner:
+                fields[name].flags.writeable = False
+        return head, dt, fields
+
+    def publish(self, state):
+        n = len(state)
+        if n > self.capacity:
+            raise ValueError(f"{n} bodies don't fit a frame bus of capacity {self.capacity}")
+        generation = int(self.header[2]) + 1
+        head, dt, fields = self.views[generation % self.slots]
+        head[0] = -1
+        fields["ids"][:n] = state.ids
+        fields["mass"][:n] = state.mass
+        fields["radius"][:n] = state.radii()
+        fields["position"][:n] = state.position
+        fields["velocity"][:n] = state.velocity
+        fields["color"][:n] = state.colors()
+        head[1], head[2] = state.iteration, n
+        dt[0] = state.dt
+        head[0] = generation
+        self.header[2] = generation
+
+    def frame(self, generation):
+        # The frame of that generation, or None if it's gone
+        head, dt, fields = self.views[generation % self.slots]
+        if generation < 0 or head[0] != generation:
+            return None
+        n = int(head[2])
+        frame = BusFrame(generation, int(head[1]), float(dt[0]),
+                         {name: view[:n] for name, view in fields.items()}, head)
+        return frame if frame.valid() else None
+
+    def latest(self):
+        return self.frame(int(self.header[2]))
+
+    @property
+    def finished(self):
+        return bool(self.header[3])
+
+    def frames(self, poll=0.005, copy=False):
+        # Every frame from now on, in order, until the publisher finishes;
+        # with copy=True each one is detached from the bus
+        last = int(self.header[2]) - 1
+        while True:
+            latest = int(self.header[2])
+            if latest == last:
+                # The last frames may have gone out between reading the
+                # generation and the flag, so look again before stopping
+                if self.finished and int(self.header[2]) == last:
+                    return
+                if not self.finished:
+                    time.sleep(poll)
+                continue
+            for generation in range(max(last + 1, latest - self.slots + 2), latest + 1):
+                frame = self.frame(generation)
+                if frame is None:
+                    continue
+                if copy:
+                    # Only once the slot is known intact after copying
+                    detached = frame.copy()
+                    if not frame.valid():
+                        continue
+                    frame = detached
+                yield frame
+            last = latest
+
+    def close(self):
+        # The publisher also marks the bus finished and removes it; readers
+        # already attached keep their mapping until they close
+        if self.owner:
+            self.header[3] = 1
+        self.header = None
+        self.views = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Frames handed out still point into the block; it is released
+            # when they are
+            pass
+        if self.owner:
+            self.shm.unlink()
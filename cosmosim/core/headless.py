@@ -0,0 +1,77 @@
+import sys
+import os
+import json
+import time
+import importlib
+import subprocess
+
+# =============================================================================
+# Headless runs for batch nodes. Only numpy and the simulation core are
+# imported up front; scipy submodules are loaded by the force and collision
+# code on first use, and tqdm, pygame, matplotlib and sklearn never are.
+#
+#   python -m cosmosim.core.headless mypackage.setups:make_universe [outpath]
+#   python -m cosmosim.core.headless --check-imports [budget in seconds]
+# =============================================================================
+
+# Modules a headless run must not load
+DISPLAY_MODULES = ("pygame", "matplotlib", "tqdm", "sklearn")
+
+# Wall time allowed for a cold import of the simulation core
+IMPORT_BUDGET = 0.5
+
+USAGE = ("usage: python -m cosmosim.core.headless package.module:function [outpath]\n"
+         "       python -m cosmosim.core.headless --check-imports [budget in seconds]")
+
+def load_setup(spec):
+    # "package.module:function" -> the function, which returns a Universe
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name or "setup")
+
+def run(setup, outpath=None):
+    universe = load_setup(setup)() if isinstance(setup, str) else setup()
+    if outpath:
+        universe.outpath = os.path.join(outpath, "")
+        universe.run(progress=False)
+    else:
+        universe.run(progress=False, record=False)
+    return universe
+
+def import_time(module="cosmosim.core.universe", repeat=5):
+    # Best of `repeat` cold imports, each in a fresh interpreter, and the
+    # display modules that came along with it
+    probe = ("import sys, time, json\n"
+             "start = time.perf_counter()\n"
+             f"import {module}\n"
+             "seconds = time.perf_counter() - start\n"
+             f"loaded = [m for m in {DISPLAY_MODULES!r} if m in sys.modules]\n"
+             "print(json.dumps([seconds, loaded]))")
+    best, loaded = float("inf"), []
+    for i in range(repeat):
+        out = subprocess.run([sys.executable, "-c", probe], check=True,
+                             capture_output=True, text=True).stdout
+        seconds, loaded = json.loads(out)
+        best = min(best, seconds)
+    return best, loaded
+
+def check_imports(budget=IMPORT_BUDGET, module="cosmosim.core.universe"):
+    seconds, loaded = import_time(module)
+    if loaded:
+        raise RuntimeError(f"Importing {module} loaded {', '.join(loaded)}")
+    if seconds > budget:
+        raise RuntimeError(f"Importing {module} took {seconds:.3f}s, over the {budget:.3f}s budget")
+    return seconds
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(USAGE, file=sys.stderr)
+        sys.exit(2)
+    if sys.argv[1] == "--check-imports":
+        budget = float(sys.argv[2]) if len(sys.argv) > 2 else IMPORT_BUDGET
+        print(f"Import time: {check_imports(budget):.3f}s (budget {budget:.3f}s)")
+    else:
+        start = time.perf_counter()
+        universe = run(*sys.argv[1:3])
+        print(f"{universe.iterations} iterations, {len(universe.state)} bodies, "
+              f"{time.perf_counter() - start:.1f}s")
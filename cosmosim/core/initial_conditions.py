@@ -0,0 +1,108 @@
+import numpy as np
+
+# =============================================================================
+# Bulk initial-condition generators. Each one draws all N bodies in a handful
+# of NumPy calls and appends them straight to the arrays of a State, returning
+# the ids of the new bodies.
+#
+# Scalar parameters are used as-is; (low, high) tuples are sampled uniformly.
+# Without an explicit rng the State's own seeded generator is used. With
+# test=True the bodies are test particles that feel gravity but don't exert it.
+# =============================================================================
+
+def _sample(rng, value, n):
+    if isinstance(value, tuple):
+        low, high = value
+        return rng.uniform(low, high, n)
+    return np.full(n, float(value))
+
+def _isotropic(rng, n):
+    # Uniformly distributed unit vectors
+    cos_phi = rng.uniform(-1, 1, n)
+    sin_phi = np.sqrt(1 - cos_phi**2)
+    theta = rng.uniform(0, 2*np.pi, n)
+    return np.column_stack([sin_phi*np.cos(theta), sin_phi*np.sin(theta), cos_phi])
+
+def keplerian_disk(state, n, central_mass, r_min, r_max, mass, density,
+                   thickness=0.0, center=(0,0,0), center_velocity=(0,0,0),
+                   test=False, rng=None):
+    # Bodies on circular, counter-clockwise orbits in the xy plane around a
+    # central mass that is not itself part of the disk
+    rng = rng if rng is not None else state.rng
+    r = rng.uniform(r_min, r_max, n)
+    theta = rng.uniform(0, 2*np.pi, n)
+    z = rng.normal(0, thickness, n) if thickness else np.zeros(n)
+    position = np.column_stack([r*np.cos(theta), r*np.sin(theta), z])
+    v_mag = np.sqrt(state.G*central_mass/r)
+    velocity = np.column_stack([-v_mag*np.sin(theta), v_mag*np.cos(theta),
+                                np.zeros(n)])
+    return state.add_bodies(mass=_sample(rng, mass, n),
+                            density=_sample(rng, density, n),
+                            position=position + np.asarray(center),
+                            velocity=velocity + np.asarray(center_velocity),
+                            test=test)
+
+def uniform_sphere(state, n, radius, mass, density, velocity_dispersion=0.0,
+                   center=(0,0,0), center_velocity=(0,0,0), test=False, rng=None):
+    # Homogeneous ball with isotropic Gaussian velocities
+    rng = rng if rng is not None else state.rng
+    r = radius*rng.uniform(0, 1, n)**(1/3)
+    position = r[:,None]*_isotropic(rng, n)
+    velocity = rng.normal(0, velocity_dispersion, (n, 3))
+    return state.add_bodies(mass=_sample(rng, mass, n),
+                            density=_sample(rng, density, n),
+                            position=position + np.asarray(center),
+                            velocity=velocity + np.asarray(center_velocity),
+                            test=test)
+
+def plummer_sphere(state, n, total_mass, scale_radius, density,
+                   center=(0,0,0), center_velocity=(0,0,0), test=False, rng=None):
+    # Equal-mass Plummer model in virial equilibrium (Aarseth, Henon &
+    # Wielen 1974)
+    rng = rng if rng is not None else state.rng
+    a = scale_radius
+    # Radii by inverting the cumulative mass profile, cut off at 0.999 of the
+    # mass so that no body starts out absurdly far away
+    u = rng.uniform(0, 0.999, n)
+    r = a/np.sqrt(u**(-2/3) - 1)
+    position = r[:,None]*_isotropic(rng, n)
+    # Speeds as a fraction q of the local escape speed, with q drawn from
+    # g(q) = q^2 (1 - q^2)^3.5 by rejection sampling
+    q = np.empty(n)
+    todo = np.arange(n)
+    while todo.size:
+        x = rng.uniform(0, 1, todo.size)
+        y = rng.uniform(0, 0.1, todo.size)
+        accepted = y < x**2*(1 - x**2)**3.5
+        q[todo[accepted]] = x[accepted]
+        todo = todo[~accepted]
+    v_escape = np.sqrt(2*state.G*total_mass/np.sqrt(r**2 + a**2))
+    velocity = (q*v_escape)[:,None]*_isotropic(rng, n)
+    return state.add_bodies(mass=np.full(n, total_mass/n),
+                            density=_sample(rng, density, n),
+                            position=position + np.asarray(center),
+                            velocity=velocity + np.asarray(center_velocity),
+                            test=test)
+
+def rotating_cloud(state, n, r_max, omega, mass, density, r_min=0.0,
+                   max_velocity=0.0, flat=False, center=(0,0,0), test=False, rng=None):
+    # Solid-body rotation about the z axis plus a random velocity of up to
+    # max_velocity, as in examples/cloud.py
+    rng = rng if rng is not None else state.rng
+    direction = _isotropic(rng, n)
+    if flat:
+        theta = rng.uniform(0, 2*np.pi, n)
+        direction = np.column_stack([np.cos(theta), np.sin(theta), np.zeros(n)])
+    r = rng.uniform(r_min, r_max, n)
+    position = r[:,None]*direction
+    velocity = omega*np.column_stack([-position[:,1], position[:,0], np.zeros(n)])
+    if max_velocity:
+        v_random = rng.uniform(0, max_velocity, n)[:,None]*_isotropic(rng, n)
+        if flat:
+            v_random[:,2] = 0.0
+        velocity += v_random
+    return state.add_bodies(mass=_sample(rng, mass, n),
+                            density=_sample(rng, density, n),
+                            position=position + np.asarray(center),
+                            velocity=velocity,
+                            test=test)
@@ -0,0 +1,130 @@
+import math
+from cosmosim.util.autotune import BLAS_MAX_BODIES
+from cosmosim.util.pm import short_range_pairs
+
+# =============================================================================
+# Memory planning for Universe.run. Peak usage is estimated up front from the
+# number of bodies, the force backend, collisions and how frames are
+# recorded. Given a budget, the planner then trades speed for memory until
+# the estimate fits: the BLAS kernel gives way to the tiled direct sum, and
+# tiles shrink. Frames kept in memory are left alone; a run that only fits
+# recording to disk is told to pass an outpath. The estimates are
+# deliberately rough (within a factor of ~2) and err high.
+# =============================================================================
+
+BODY_BYTES = 74         # ids, mass, density, position, velocity, frozen, test
+STEP_BYTES = 200        # Temporaries of one State.interact, per body
+NEIGHBOR_BYTES = 400    # Verlet pairs, their distances and the k-d tree
+FRAME_BYTES = 4096      # Per saved frame, on top of its body arrays
+PAIR_BYTES = 100        # P3M short-range pairs, their separations and forces
+PAIR_GUESS = 150        # Short-range pairs per body when there are no positions
+MIN_TILE = 16
+
+def format_bytes(b):
+    for unit in ("B", "KB", "MB", "GB"):
+        if b < 1024:
+            return f"{b:.0f} {unit}"
+        b /= 1024
+    return f"{b:.1f} TB"
+
+def force_bytes(n, force, options=None, position=None):
+    options = options or {}
+    if force == "blas":
+        # Three packed n x n complex matrices plus the packed distances
+        return 28*n*n
+    if force == "direct":
+        return 88*options.get("tile", 256)*n
+    if force == "tree":
+        # Nodes and sorted copies, plus the (target, node) frontier of a tile
+        return 400*n + 20000*options.get("tile", 4096)
+    if force == "pm":
+        g = options.get("grid", 64)
+        # Mass grid, its padded FFT and the cached Green's function
+        mesh = 32*g**3 + 64*(2*g)**3
+        if not options.get("p3m", True):
+            return mesh
+        # The short-range sum keeps every pair within a few cells at once,
+        # so it is counted on the actual bodies when they are known
+        if position is not None:
+            pairs = short_range_pairs(position, g, options.get("split", 1.25))
+        else:
+            pairs = PAIR_GUESS*n
+        return mesh + NEIGHBOR_BYTES*n + PAIR_BYTES*pairs
+    # Unknown callables: assume a direct sum
+    return 88*256*n
+
+def estimate(universe, record=True):
+    # Peak bytes of each part of a run, as a dict
+    state = universe.state
+    n = len(state)
+    # Test particles don't enter the short-range pairs
+    sources = state.position[~state.test]
+    if state.autotuner is not None:
+        # Every candidate runs while tuning
+        force = max(force_bytes(n, name, state.autotuner.options.get(name), sources)
+                    for name in state.autotuner.candidates
+                    if name != "blas" or n <= BLAS_MAX_BODIES)
+    else:
+        force = force_bytes(n, state.force, state.force_options, sources)
+    frame = n*BODY_BYTES + FRAME_BYTES
+    if record and not universe.outpath:
+        recording = math.ceil(universe.iterations/universe.stride)*frame
+    else:
+        # One frame pickled at a time
+        recording = frame
+    return {
+        "state": n*(BODY_BYTES + STEP_BYTES),
+        "force": force,
+        "collisions": n*NEIGHBOR_BYTES,
+        "recording": recording,
+    }
+
+def report(usage):
+    parts = ", ".join(f"{name} {format_bytes(b)}" for name, b in usage.items())
+    return f"Estimated peak memory: {format_bytes(sum(usage.values()))} ({parts})"
+
+def _set_tile(state, name, tile):
+    options = state.autotuner.options if state.autotuner is not None else None
+    if options is not None:
+        options.setdefault(name, {})["tile"] = tile
+    elif state.force == name:
+        state.force_options["tile"] = tile
+
+def plan(universe, budget=None, record=True):
+    # Estimate the run's memory and, with a budget (bytes), adjust the run
+    # until it fits. Returns the estimate and a list of the changes made;
+    # MemoryError if it can't be made to fit. Frames recorded in memory stay
+    # there: where they go is the caller's choice, through outpath.
+    usage = estimate(universe, record)
+    if budget is None or sum(usage.values()) <= budget:
+        return usage, []
+    state = universe.state
+    changes = []
+    # Forces: the tiled direct sum gives the same answer as BLAS in bounded
+    # memory
+    if sum(usage.values()) > budget:
+        if state.autotuner is not None and "blas" in state.autotuner.candidates:
+            state.autotuner.candidates = tuple(c for c in state.autotuner.candidates if c != "blas") or ("direct",)
+            changes.append("blas dropped from the autotune candidates")
+        elif state.force == "blas":
+            state.force = "direct"
+            changes.append("direct forces instead of blas")
+        usage = estimate(universe, record)
+    # Then shrink the tiles into whatever is left
+    names = state.autotuner.candidates if state.autotuner is not None else (state.force,)
+    for name, per_tile in (("direct", 88*len(state)), ("tree", 20000)):
+        if name not in names or sum(usage.values()) <= budget:
+            continue
+        spare = budget - (sum(usage.values()) - usage["force"])
+        fixed = force_bytes(len(state), name, {"tile": 0})
+        tile = max(MIN_TILE, int((spare - fixed)//per_tile))
+        _set_tile(state, name, tile)
+        changes.append(f"{name} tile of {tile}")
+        usage = estimate(universe, record)
+    if sum(usage.values()) > budget:
+        message = f"{report(usage)} exceeds the budget of {format_bytes(budget)}"
+        frame = len(state)*BODY_BYTES + FRAME_BYTES
+        if record and not universe.outpath and sum(usage.values()) - usage["recording"] + frame <= budget:
+            message += "; pass an outpath to record the frames to disk"
+        raise MemoryError(message)
+    return usage, changes
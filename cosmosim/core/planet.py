@@ -1,9 +1,7 @@
-import pygame
 import numpy as np
 import random
 import math
 import cosmosim.util.functions as F
-import cosmosim.util.pronounceable.main as prnc
 
 WHITE = (255,255,255)
 YELLOW = (255,255,0)
@@ -30,13 +28,13 @@ class Planet:
         self.energy = 0
         self.color = color
         self.immobile = immobile
-        self.history = []
         self.bound = False
         self.clicked = False
         self.tracked = False
         self.alive = True
         self.planets_eaten = 0
         if not self.name:
+            import cosmosim.util.pronounceable.main as prnc
             self.name = prnc.generate_word()
         if not self.color:
             self.color = (int(255*random.random()),int(255*random.random()),int(255*random.random()))
@@ -62,15 +60,6 @@ class Planet:
                                            name=name,
                                            color=color)
             
-    def update_history(self, trail_length):
-        if self.alive and self.tracked:
-            pos = np.array([self.position[0],self.position[1]])
-            self.history.append(pos)
-        else:
-            self.history = []
-        if len(self.history) > trail_length:
-            self.history.remove(self.history[0])
-                
     def absorb(self, planet):
         if self.alive and planet.alive:
             if not self.immobile:
@@ -91,29 +80,17 @@ class Planet:
         self.energy = 0
      
     def draw(self, screen, color):
+        import pygame
         scale = self.universe.context['scale']
         # Set the radius of the planet
         radius = max(1, int(self.radius*scale))
         # Draw
         if self.alive:
-            q = F.screen_coordinates(self.position, **self.universe.context) 
+            q = F.screen_coordinates(self.position, **self.universe.context)
             if self.clicked:
                 # Highlight the planet
                  pygame.draw.circle(screen, WHITE, q.astype(int), max(int(radius*2), 4)) 
                  pygame.draw.circle(screen, BLACK, q.astype(int), max(int(radius*1.85), 2))
-            if self.tracked:
-                 # Trace the planet's path
-                 h_length = len(self.history)
-                 #for i, p in enumerate(self.history):
-                 for i in range(h_length):
-                     if i > 0:
-                         p0 = self.history[i-1]
-                         p = self.history[i]
-                         alpha = i/h_length
-                         trail_color = tuple(alpha*i for i in self.color)
-                         q = F.screen_coordinates(p, **self.universe.context)
-                         q0 = F.screen_coordinates(p0, **self.universe.context)
-                         pygame.draw.line(screen, trail_color, q0.astype(int), q.astype(int), 1)
             # Draw the planet itself
             pygame.draw.circle(screen, color, q.astype(int), radius)   
     
\ No newline at end of file
@@ -0,0 +1,225 @@
+import numpy as np
+import os
+import sys
+import json
+import math
+from cosmosim.core.trajectory import indexed_states, read_frame, data_files
+from cosmosim.util.progress import progress_bar
+
+# =============================================================================
+# Trajectory pyramids, for scrubbing through and zooming out of long, large
+# runs. Level 0 is the run itself, made randomly accessible by an index of
+# where each frame starts. Level L keeps every factor**L-th frame, and each
+# of its frames is reduced to
+#
+#   - the top_k most massive bodies, with their ids, and
+#   - the mass in a grid of cells over the frame, each shown as one blob at
+#     its centre of mass. The grid is grid/factor**(L-1) cells a side, and
+#     never finer than about one cell per body.
+#
+# Like the event log, every level is appended to one raw binary file per
+# column as the run is read, so building takes memory for one frame only.
+#
+#   outpath/pyramid.json, outpath/frames.bin (file number, byte offset)
+#   outpath/level_L/{iterations, top_ids, top_position, top_radius,
+#                    top_color, cells, cell_position, cell_mass,
+#                    cell_count, cell_size}.bin
+#
+# python -m cosmosim.core.pyramid <run directory> [<output directory>]
+# =============================================================================
+
+def level_columns(top_k):
+    # name: (dtype, shape of one row); "cells" is the number of cells of
+    # each frame, the cell_* columns have a row per cell
+    return {
+        "iterations": (np.int64, ()),
+        "top_ids": (np.int64, (top_k,)),
+        "top_position": (np.float64, (top_k, 3)),
+        "top_radius": (np.float64, (top_k,)),
+        "top_color": (np.uint8, (top_k, 3)),
+        "cells": (np.int64, ()),
+        "cell_position": (np.float64, (3,)),
+        "cell_mass": (np.float64, ()),
+        "cell_count": (np.int64, ()),
+        "cell_size": (np.float64, ()),
+    }
+
+def level_grid(grid, factor, level, n):
+    # Cells a side at a level
+    side = grid//factor**(level - 1)
+    return max(2, min(side, int(round(n**(1/3)))))
+
+def column_path(path, level, name):
+    return os.path.join(path, f"level_{level}", f"{name}.bin")
+
+def top_bodies(state, k):
+    # Ids, positions, radii and colors of the k most massive bodies, padded
+    # with -1 ids and NaN positions to exactly k rows
+    order = np.argsort(-state.mass, kind="stable")[:k]
+    ids = np.full(k, -1, dtype=np.int64)
+    position = np.full((k, 3), np.nan)
+    radius = np.zeros(k)
+    color = np.zeros((k, 3), dtype=np.uint8)
+    ids[:order.size] = state.ids[order]
+    position[:order.size] = state.position[order]
+    radius[:order.size] = state.radii()[order]
+    color[:order.size] = state.colors()[order]
+    return ids, position, radius, color
+
+def cells(position, mass, grid):
+    # Mass, centre of mass and body count of the occupied cells of a
+    # grid^3 mesh over the bounding box; also the cell width
+    if len(position) == 0:
+        return np.zeros((0, 3)), np.zeros(0), np.zeros(0, dtype=np.int64), 0.0
+    lo = position.min(axis=0)
+    size = float((position.max(axis=0) - lo).max())/grid or 1.0
+    index = np.clip(((position - lo)/size).astype(int), 0, grid - 1)
+    flat = (index[:,0]*grid + index[:,1])*grid + index[:,2]
+    occupied, inverse = np.unique(flat, return_inverse=True)
+    count = np.bincount(inverse)
+    total = np.bincount(inverse, weights=mass)
+    weight = np.where(total > 0, total, 1.0)
+    center = np.column_stack([np.bincount(inverse, weights=mass*position[:,d])/weight
+                              for d in range(3)])
+    # Cells of massless bodies sit at their mean position
+    empty = total <= 0
+    if empty.any():
+        mean = np.column_stack([np.bincount(inverse, weights=position[:,d])/count
+                                for d in range(3)])
+        center[empty] = mean[empty]
+    return center, total, count, size
+
+def build(path, outpath=None, levels=4, factor=4, top_k=1024, grid=64,
+          progress=True):
+    outpath = outpath or os.path.join(path, "pyramid")
+    columns = level_columns(top_k)
+    files = {}
+    for level in range(1, levels + 1):
+        os.makedirs(os.path.join(outpath, f"level_{level}"), exist_ok=True)
+        for name, (dtype, _) in columns.items():
+            files[level, name] = open(column_path(outpath, level, name), "wb")
+    frames = 0
+    dt = None
+    with open(os.path.join(outpath, "frames.bin"), "wb") as index:
+        for k, (entry, state) in enumerate(progress_bar(indexed_states(path),
+                                                        desc="Building pyramid",
+                                                        disable=not progress)):
+            np.array(entry, dtype=np.int64).tofile(index)
+            frames += 1
+            dt = state.dt
+            for level in range(1, levels + 1):
+                if k % factor**level:
+                    break
+                ids, position, radius, color = top_bodies(state, top_k)
+                center, mass, count, size = cells(state.position, state.mass,
+                                                  level_grid(grid, factor, level, len(state)))
+                row = {"iterations": state.iteration, "top_ids": ids,
+                       "top_position": position, "top_radius": radius,
+                       "top_color": color, "cells": len(mass),
+                       "cell_position": center, "cell_mass": mass,
+                       "cell_count": count, "cell_size": size}
+                for name, (dtype, _) in columns.items():
+                    np.asarray(row[name], dtype=dtype).tofile(files[level, name])
+    for f in files.values():
+        f.close()
+    meta = {"frames": frames, "levels": levels, "factor": factor,
+            "top_k": top_k, "grid": grid, "dt": dt,
+            "files": [os.path.basename(f) for f in data_files(path)]}
+    with open(os.path.join(outpath, "pyramid.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return outpath
+
+
+class Overview:
+    # A reduced frame, drawn like a State: the cells as grey blobs, brighter
+    # the more bodies they hold, with the top bodies in their own colors on
+    # top. Cells have id -1.
+
+    def __init__(self, iteration, dt, top_ids, top_position, top_radius,
+                 top_color, cell_position, cell_count, cell_size):
+        real = top_ids >= 0
+        self.iteration = iteration
+        self.dt = dt
+        self.top_color = top_color[real]
+        self.ids = np.r_[np.full(len(cell_count), -1), top_ids[real]]
+        self.position = np.concatenate([cell_position, top_position[real]])
+        self.velocity = np.zeros_like(self.position)
+        self.radius = np.r_[np.full(len(cell_count), 0.35*cell_size), top_radius[real]]
+        self.cell_count = cell_count
+
+    def __len__(self):
+        return self.ids.size
+
+    def positions(self):
+        return self.position
+
+    def radii(self):
+        return self.radius
+
+    def colors(self):
+        cells = self.ids < 0
+        colors = np.empty((len(self), 3), dtype=np.uint8)
+        colors[~cells] = self.top_color
+        shade = np.log1p(self.cell_count)/max(np.log1p(self.cell_count.max(initial=1)), 1e-9)
+        colors[cells] = (40 + 160*shade)[:,None].astype(np.uint8)
+        return colors
+
+
+class Pyramid:
+
+    def __init__(self, outpath, run_path=None):
+        # run_path: the run's directory, by default the one holding outpath
+        self.outpath = outpath
+        self.run_path = run_path or os.path.dirname(os.path.normpath(outpath))
+        with open(os.path.join(outpath, "pyramid.json")) as f:
+            meta = json.load(f)
+        self.frames = meta["frames"]
+        self.levels = meta["levels"]
+        self.factor = meta["factor"]
+        self.dt = meta["dt"]
+        self.files = [os.path.join(self.run_path, f) for f in meta["files"]]
+        self.index = np.fromfile(os.path.join(outpath, "frames.bin"), dtype=np.int64).reshape(-1, 2)
+        self.data = {}
+        for level in range(1, self.levels + 1):
+            data = {}
+            for name, (dtype, shape) in level_columns(meta["top_k"]).items():
+                filename = column_path(outpath, level, name)
+                if os.path.getsize(filename):
+                    data[name] = np.memmap(filename, dtype=dtype, mode="r").reshape((-1,) + shape)
+                else:
+                    data[name] = np.zeros((0,) + shape, dtype=dtype)
+            data["cell_offsets"] = np.r_[0, np.cumsum(data["cells"], dtype=np.int64)]
+            self.data[level] = data
+
+    def cell_size(self, level):
+        # Typical cell width at a level, for choosing one by zoom
+        if level == 0:
+            return 0.0
+        return float(np.median(self.data[level]["cell_size"]))
+
+    def frame(self, level, k):
+        # Frame at or just before full-resolution frame k, from a level
+        if level == 0:
+            return read_frame(self.run_path, self.index[k], self.files)
+        d = self.data[level]
+        j = min(k//self.factor**level, len(d["iterations"]) - 1)
+        start, end = d["cell_offsets"][j], d["cell_offsets"][j+1]
+        return Overview(int(d["iterations"][j]), self.dt,
+                        np.array(d["top_ids"][j]), np.array(d["top_position"][j]),
+                        np.array(d["top_radius"][j]), np.array(d["top_color"][j]),
+                        np.array(d["cell_position"][start:end]),
+                        np.array(d["cell_count"][start:end]),
+                        float(d["cell_size"][j]))
+
+    def level_for(self, speed=1, scale=None, min_pixels=2):
+        # Coarsest level whose frames are no further apart than the playback
+        # speed (in frames per shown frame), and coarser still while the
+        # next level's cells would be under min_pixels on screen
+        level = min(self.levels, int(math.log(max(speed, 1), self.factor) + 1e-9))
+        while scale is not None and level < self.levels and self.cell_size(level + 1)*scale < min_pixels:
+            level += 1
+        return level
+
+
+if __name__ == '__main__':
+    build(*sys.argv[1:3])
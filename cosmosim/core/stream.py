@@ -0,0 +1,442 @@
+import numpy as np
+import os
+import sys
+import json
+import math
+import queue
+import struct
+import asyncio
+import threading
+import cosmosim.util.functions as F
+from cosmosim.core.framebus import FrameBus
+from cosmosim.core.trajectory import read_states
+
+# =============================================================================
+# Frame streaming over TCP, for watching a run on a compute node from a
+# workstation. The server reads frames from a FrameBus (a live run) or a run
+# directory and sends each client the newest one whenever the client has
+# taken the previous one, so slow links drop frames rather than fall behind.
+#
+# A client tells the server what it shows (its camera and screen size, a
+# Viewport) and gets only the bodies on or near its screen, with positions
+# quantized to half a pixel. A body already sent is then updated by its
+# int16 change in quantized position; new or merged bodies, and bodies that
+# moved too far, are sent in full.
+#
+#   message   uint8 kind, uint32 length, payload
+#   frame     iteration, dt, origin[3], quantum, n_prev, n_kept, n_new
+#             kept mask over the previous frame's bodies (packed bits)
+#             int16[n_kept, 3] position changes, in quantum
+#             int64[n_new] ids, int32[n_new, 3] positions relative to the
+#             origin, float32[n_new] radii, uint8[n_new, 3] colors
+#
+# python -m cosmosim.core.stream <bus name or run directory> [host:port]
+# InteractiveAnimation("tcp://host:port").play()
+# =============================================================================
+
+PROTOCOL = 1
+PORT = 8765
+HELLO, FRAME, END, VIEWPORT = b"H", b"F", b"E", b"V"
+
+MESSAGE = struct.Struct("!cI")
+FRAME_HEADER = struct.Struct("<qd3ddIII")
+DELTA_MAX = np.iinfo(np.int16).max
+POSITION_MAX = np.iinfo(np.int32).max
+
+def parse_address(address, host="127.0.0.1", port=PORT):
+    # "tcp://host:port", "host:port" or "host"
+    address = address.split("://", 1)[-1]
+    if ":" in address:
+        address, port = address.rsplit(":", 1)
+    return address or host, int(port)
+
+async def send(writer, kind, payload=b""):
+    writer.write(MESSAGE.pack(kind, len(payload)) + payload)
+    await writer.drain()
+
+async def receive(reader):
+    kind, length = MESSAGE.unpack(await reader.readexactly(MESSAGE.size))
+    return kind, await reader.readexactly(length)
+
+
+class Viewport:
+    # What a client shows: the camera from cosmosim.util.functions.camera,
+    # the screen size in pixels and a margin around it (a fraction of the
+    # screen) so bodies don't pop in at the edges while panning
+
+    def __init__(self, matrix, shift, width, height, margin=0.25):
+        self.matrix = np.asarray(matrix, dtype=float)
+        self.shift = np.asarray(shift, dtype=float)
+        self.width = width
+        self.height = height
+        self.margin = margin
+
+    @classmethod
+    def from_camera(cls, camera, width, height, margin=0.25):
+        return cls(*camera, width, height, margin)
+
+    def to_dict(self):
+        return {"matrix": self.matrix.tolist(), "shift": self.shift.tolist(),
+                "width": self.width, "height": self.height, "margin": self.margin}
+
+    @property
+    def scale(self):
+        # Pixels per meter
+        return float(np.linalg.norm(self.matrix[:,0]))
+
+    def quantum(self):
+        # Half a pixel, rounded down to a power of two so that zooming only
+        # changes it every octave
+        return 2.0**math.floor(math.log2(0.5/self.scale))
+
+    def center(self):
+        # World point shown at the middle of the screen
+        middle = np.array([self.width/2, self.height/2])
+        c = np.zeros(3)
+        c[:len(self.matrix)] = (middle - self.shift) @ np.linalg.pinv(self.matrix)
+        return c
+
+    def visible(self, position, radius):
+        q = F.project(position[:,:len(self.matrix)], (self.matrix, self.shift))
+        r = radius*self.scale
+        mx, my = self.margin*self.width, self.margin*self.height
+        x, y = q.T
+        return ((x + r >= -mx) & (x - r <= self.width + mx)
+                & (y + r >= -my) & (y - r <= self.height + my))
+
+
+class RemoteFrame:
+    # A frame as a stream client sees it: State-like enough for the players,
+    # without masses or velocities
+
+    def __init__(self, iteration, dt, ids, position, radius, color):
+        self.iteration = iteration
+        self.dt = dt
+        self.ids = ids
+        self.position = position
+        self.velocity = np.zeros_like(position)
+        self.radius = radius
+        self.color = color
+
+    def __len__(self):
+        return self.ids.size
+
+    def positions(self):
+        return self.position
+
+    def radii(self):
+        return self.radius
+
+    def colors(self):
+        return self.color
+
+
+class Encoder:
+    # One client's side of the delta encoding: what it was last sent
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.q = np.zeros((0, 3), dtype=np.int64)
+        self.radius = np.zeros(0, dtype=np.float32)
+        self.color = np.zeros((0, 3), dtype=np.uint8)
+        self.origin = None
+        self.quantum = None
+
+    def encode(self, frame, viewport=None):
+        position, radius = frame.positions(), frame.radii()
+        if viewport is not None:
+            keep = viewport.visible(position, radius)
+            quantum, center = viewport.quantum(), viewport.center()
+        else:
+            keep = np.ones(len(frame), dtype=bool)
+            lo = position.min(axis=0) if len(position) else np.zeros(3)
+            hi = position.max(axis=0) if len(position) else np.zeros(3)
+            extent = float((hi - lo).max()) or 1.0
+            quantum, center = 2.0**math.ceil(math.log2(extent/2**30)), (lo + hi)/2
+        ids = np.asarray(frame.ids)[keep]
+        radius = radius[keep].astype(np.float32)
+        color = np.asarray(frame.colors())[keep]
+        # Start over when the precision changes or the bodies drift out of
+        # reach of the origin
+        q = None
+        if quantum == self.quantum:
+            q = np.round((position[keep] - self.origin)/quantum)
+            if len(q) and np.abs(q).max() > POSITION_MAX:
+                q = None
+        if q is None:
+            self.reset()
+            self.quantum, self.origin = quantum, np.round(center/quantum)*quantum
+            q = np.round((position[keep] - self.origin)/quantum).clip(-POSITION_MAX, POSITION_MAX)
+        q = q.astype(np.int64)
+        # Bodies the client has, unchanged but for a small move, are kept
+        n_prev = len(self.ids)
+        order = np.argsort(self.ids)
+        loc = np.searchsorted(self.ids[order], ids).clip(0, max(n_prev - 1, 0))
+        prev = order[loc] if n_prev else loc
+        ok = self.ids[prev] == ids if n_prev else np.zeros(len(ids), dtype=bool)
+        ok[ok] = ((np.abs(q[ok] - self.q[prev[ok]]).max(axis=1, initial=0) <= DELTA_MAX)
+                  & (radius[ok] == self.radius[prev[ok]])
+                  & (color[ok] == self.color[prev[ok]]).all(axis=1))
+        mask = np.zeros(n_prev, dtype=bool)
+        mask[prev[ok]] = True
+        current = np.full(n_prev, -1)
+        current[prev[ok]] = np.flatnonzero(ok)
+        kept = current[mask]
+        new = np.flatnonzero(~ok)
+        payload = b"".join([
+            FRAME_HEADER.pack(int(frame.iteration), float(frame.dt), *self.origin,
+                              self.quantum, n_prev, len(kept), len(new)),
+            np.packbits(mask).tobytes(),
+            (q[kept] - self.q[mask]).astype("<i2").tobytes(),
+            ids[new].astype("<i8").tobytes(),
+            q[new].astype("<i4").tobytes(),
+            radius[new].astype("<f4").tobytes(),
+            color[new].astype(np.uint8).tobytes(),
+        ])
+        self.ids = np.r_[self.ids[mask], ids[new]]
+        self.q = np.concatenate([q[kept], q[new]])
+        self.radius = np.r_[self.radius[mask], radius[new]]
+        self.color = np.concatenate([self.color[mask], color[new]])
+        return payload
+
+
+class Decoder:
+    # The client's side: rebuilds each frame from the last one
+
+    def __init__(self):
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.q = np.zeros((0, 3), dtype=np.int64)
+        self.radius = np.zeros(0, dtype=np.float32)
+        self.color = np.zeros((0, 3), dtype=np.uint8)
+
+    def decode(self, payload):
+        iteration, dt, x, y, z, quantum, n_prev, n_kept, n_new = FRAME_HEADER.unpack_from(payload)
+        if n_prev == 0:
+            # The server started over
+            self.__init__()
+        elif n_prev != len(self.ids):
+            raise ValueError(f"Frame is relative to {n_prev} bodies, the client has {len(self.ids)}")
+        offset = FRAME_HEADER.size
+        def take(dtype, count, width=1):
+            nonlocal offset
+            a = np.frombuffer(payload, dtype, count*width, offset)
+            offset += a.nbytes
+            return a.reshape(-1, width) if width > 1 else a
+        mask = np.unpackbits(take(np.uint8, -(-n_prev//8)), count=n_prev).astype(bool)
+        delta = take("<i2", n_kept, 3)
+        ids, q = take("<i8", n_new), take("<i4", n_new, 3)
+        radius, color = take("<f4", n_new), take(np.uint8, n_new, 3)
+        self.ids = np.r_[self.ids[mask], ids]
+        self.q = np.concatenate([self.q[mask] + delta, q])
+        self.radius = np.r_[self.radius[mask], radius]
+        self.color = np.concatenate([self.color[mask], color])
+        return RemoteFrame(iteration, dt, self.ids, self.q*quantum + np.array([x, y, z]),
+                           self.radius.astype(float), self.color)
+
+
+class StreamServer:
+
+    def __init__(self, source, host="127.0.0.1", port=PORT, fps=30, poll=0.005):
+        # source: a FrameBus, the name of one, or a run directory (played
+        # through once at fps)
+        if isinstance(source, str):
+            source = source if os.path.isdir(source) else FrameBus.attach(source)
+        self.source = source
+        self.host = host
+        self.port = port
+        self.fps = fps
+        self.poll = poll
+        self.latest = None
+        self.generation = -1
+        self.finished = False
+        self.changed = None
+        self.server = None
+
+    async def start(self):
+        self.changed = asyncio.Condition()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.producer = asyncio.create_task(self.produce())
+
+    async def serve(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def publish(self, frame):
+        async with self.changed:
+            if frame is None:
+                self.finished = True
+            else:
+                self.latest = frame
+                self.generation += 1
+            self.changed.notify_all()
+
+    async def produce(self):
+        if isinstance(self.source, FrameBus):
+            bus, seen = self.source, None
+            while True:
+                frame = bus.latest()
+                if frame is not None and frame.generation != seen:
+                    seen = frame.generation
+                    # Detached, since the publisher reuses the slot
+                    frame = frame.copy()
+                    if bus.frame(seen) is not None:
+                        await self.publish(frame)
+                elif bus.finished:
+                    break
+                await asyncio.sleep(self.poll)
+        else:
+            loop = asyncio.get_running_loop()
+            states = read_states(self.source)
+            while True:
+                state = await loop.run_in_executor(None, next, states, None)
+                if state is None:
+                    break
+                await self.publish(state)
+                await asyncio.sleep(1/self.fps)
+        await self.publish(None)
+
+    async def handle(self, reader, writer):
+        encoder = Encoder()
+        client = {"viewport": None}
+        listener = asyncio.create_task(self.listen(reader, client))
+        sent = -1
+        try:
+            await send(writer, HELLO, json.dumps({"protocol": PROTOCOL}).encode())
+            while True:
+                async with self.changed:
+                    await self.changed.wait_for(lambda: self.generation != sent or self.finished)
+                    frame, generation = self.latest, self.generation
+                if generation != sent:
+                    sent = generation
+                    await send(writer, FRAME, encoder.encode(frame, client["viewport"]))
+                else:
+                    await send(writer, END)
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            listener.cancel()
+            writer.close()
+
+    async def listen(self, reader, client):
+        # Viewport updates from the client, applied from the next frame on
+        try:
+            while True:
+                kind, payload = await receive(reader)
+                if kind == VIEWPORT:
+                    client["viewport"] = Viewport(**json.loads(payload)) if payload else None
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.producer.cancel()
+
+
+class StreamClient:
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.decoder = Decoder()
+
+    @classmethod
+    async def connect(cls, address):
+        reader, writer = await asyncio.open_connection(*parse_address(address))
+        kind, payload = await receive(reader)
+        protocol = json.loads(payload).get("protocol") if kind == HELLO else None
+        if protocol != PROTOCOL:
+            writer.close()
+            raise ConnectionError(f"{address} doesn't speak cosmosim stream protocol {PROTOCOL}")
+        return cls(reader, writer)
+
+    async def set_viewport(self, viewport):
+        # A Viewport, or None for every body
+        payload = json.dumps(viewport.to_dict()).encode() if viewport else b""
+        await send(self.writer, VIEWPORT, payload)
+
+    async def frames(self):
+        while True:
+            kind, payload = await receive(self.reader)
+            if kind == END:
+                return
+            if kind == FRAME:
+                yield self.decoder.decode(payload)
+
+    def close(self):
+        self.writer.close()
+
+
+class RemoteFrames:
+    # A stream for synchronous viewers like InteractiveAnimation: the client
+    # runs on a background thread and only the newest frame is kept
+
+    def __init__(self, address):
+        self.address = address
+        self.loop = None
+        self.client = None
+        self.viewport = None
+        self.error = None
+        self.queue = queue.Queue(maxsize=1)
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=asyncio.run, args=(self.receive(),), daemon=True)
+        self.thread.start()
+
+    async def receive(self):
+        try:
+            client = await StreamClient.connect(self.address)
+            with self.lock:
+                self.loop, self.client = asyncio.get_running_loop(), client
+                viewport = self.viewport
+            if viewport is not None:
+                await client.set_viewport(viewport)
+            async for frame in client.frames():
+                self.put(frame)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            self.error = e
+        with self.lock:
+            if self.client is not None:
+                self.client.close()
+            self.loop = self.client = None
+        self.put(None)
+
+    def put(self, frame):
+        # Replace a frame the viewer hasn't taken yet
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.queue.put(frame)
+
+    def frames(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                if self.error is not None:
+                    raise ConnectionError(f"Stream from {self.address} failed: {self.error}")
+                return
+            yield frame
+
+    def set_viewport(self, viewport):
+        with self.lock:
+            self.viewport = viewport
+            if self.loop is not None:
+                asyncio.run_coroutine_threadsafe(self.client.set_viewport(viewport), self.loop)
+
+    def close(self):
+        with self.lock:
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.client.close)
+
+
+if __name__ == '__main__':
+    host, port = parse_address(sys.argv[2] if len(sys.argv) > 2 else "")
+    server = StreamServer(sys.argv[1], host, port)
+    print(f"Streaming {sys.argv[1]} on {host}:{port}")
+    asyncio.run(server.serve())
@@ -0,0 +1,120 @@
+import numpy as np
+import os
+import sys
+import pickle
+from cosmosim.util.progress import progress_bar
+
+# =============================================================================
+# Saved runs. Universe.run writes frames in time order: pickled States
+# appended to 0.dat, 1.dat, ... Pulling one body's orbit out of that means
+# unpickling everything, so transpose() rewrites a run body-major, with each
+# body's whole track stored contiguously under its stable id:
+#
+#   positions.npy   (ids, frames, 3)   NaN wherever the body doesn't exist
+#   velocities.npy  (ids, frames, 3)
+#   masses.npy      (ids, frames)
+#   iterations.npy  (frames,)
+#
+# load_track() then reads a single body with one sequential read.
+# =============================================================================
+
+TRACK_FIELDS = ("positions", "velocities", "masses")
+
+def data_files(path):
+    # Run files in the order they were written (10.dat comes after 9.dat)
+    names = [f for f in os.listdir(path) if f.endswith(".dat")]
+    return [os.path.join(path, f) for f in
+            sorted(names, key=lambda f: (len(f), f))]
+
+def read_states(path):
+    # Every saved frame of a run, in order
+    for filename in data_files(path):
+        with open(filename, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+
+def indexed_states(path):
+    # Every saved frame with its (file number, byte offset), for read_frame
+    for k, filename in enumerate(data_files(path)):
+        with open(filename, 'rb') as f:
+            while True:
+                offset = f.tell()
+                try:
+                    state = pickle.load(f)
+                except EOFError:
+                    break
+                yield (k, offset), state
+
+def read_frame(path, entry, files=None):
+    # One frame, located by indexed_states, without reading those before it
+    files = files or data_files(path)
+    k, offset = entry
+    with open(files[int(k)], 'rb') as f:
+        f.seek(int(offset))
+        return pickle.load(f)
+
+def transpose(path, outpath=None, chunk_bytes=2**26, progress=True):
+    outpath = outpath or os.path.join(path, "tracks")
+    os.makedirs(outpath, exist_ok=True)
+    # First pass: frame count and id range
+    frames = 0
+    n_ids = 0
+    for state in progress_bar(read_states(path), desc="Scanning frames", disable=not progress):
+        frames += 1
+        n_ids = max(n_ids, state.next_id)
+    tracks = {
+        "positions": np.lib.format.open_memmap(os.path.join(outpath, "positions.npy"),
+                                               mode="w+", shape=(n_ids, frames, 3)),
+        "velocities": np.lib.format.open_memmap(os.path.join(outpath, "velocities.npy"),
+                                                mode="w+", shape=(n_ids, frames, 3)),
+        "masses": np.lib.format.open_memmap(os.path.join(outpath, "masses.npy"),
+                                            mode="w+", shape=(n_ids, frames)),
+    }
+    iterations = np.zeros(frames, dtype=np.int64)
+    # Second pass: gather blocks of frames in memory so that each body's
+    # slice of a block is written as one contiguous run
+    block = max(1, chunk_bytes//max(1, n_ids*7*8))
+    buffers = {
+        "positions": np.empty((n_ids, block, 3)),
+        "velocities": np.empty((n_ids, block, 3)),
+        "masses": np.empty((n_ids, block)),
+    }
+    def flush(start, count):
+        for field in TRACK_FIELDS:
+            tracks[field][:, start:start+count] = buffers[field][:, :count]
+    start = 0
+    for k, state in enumerate(progress_bar(read_states(path), total=frames,
+                                   desc="Transposing", disable=not progress)):
+        b = k - start
+        for buffer in buffers.values():
+            buffer[:, b] = np.nan
+        buffers["positions"][state.ids, b] = state.position
+        buffers["velocities"][state.ids, b] = state.velocity
+        buffers["masses"][state.ids, b] = state.mass
+        iterations[k] = state.iteration
+        if b + 1 == block:
+            flush(start, block)
+            start += block
+    if frames > start:
+        flush(start, frames - start)
+    for track in tracks.values():
+        track.flush()
+    np.save(os.path.join(outpath, "iterations.npy"), iterations)
+    return outpath
+
+def load_track(outpath, body_id, fields=TRACK_FIELDS):
+    # One body's track over all frames, as {field: array}
+    return {field: np.array(np.load(os.path.join(outpath, f"{field}.npy"),
+                                    mmap_mode="r")[body_id])
+            for field in fields}
+
+def load_iterations(outpath):
+    return np.load(os.path.join(outpath, "iterations.npy"))
+
+
+if __name__ == '__main__':
+    # python -m cosmosim.core.trajectory <run directory> [<output directory>]
+    transpose(*sys.argv[1:3])
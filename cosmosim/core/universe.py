@@ -1,14 +1,23 @@
 import numpy as np
-import random
 import math
 import pickle
 import os
 import copy
-from tqdm import tqdm
+import heapq
+from collections import defaultdict
 import cosmosim.util.functions as F
+from cosmosim.util.progress import progress_bar
 from cosmosim.util.blas import acc_blas
-from sklearn.metrics import pairwise_distances
-import cosmosim.util.pronounceable.main as prnc
+from cosmosim.util.direct import acc_direct
+from cosmosim.util.pm import acc_pm
+from cosmosim.util.tree import Octree, acc_tree
+from cosmosim.util.autotune import Autotuner
+from cosmosim.util.neighbors import VerletList, contact_times
+from cosmosim.util.morton import morton_order
+from cosmosim.util.potentials import Callable
+import cosmosim.util.encounters as encounters
+from cosmosim.core.events import EventLog
+import cosmosim.core.memory as memory
 
 AU = 1.496e11       # Astronomical unit
 ME = 5.972e24       # Mass of the Earth
@@ -18,16 +27,28 @@ RS = 6.9634e8       # Radius of the sun
 DAYTIME = 86400     # Seconds in a day
 _G = 6.674e-11      # Gravitational constant
 
+# Force backends, called as f(positions, masses, G, **force_options)
+FORCES = {
+    "blas": acc_blas,       # Exact direct sum through BLAS
+    "direct": acc_direct,   # Exact, tiled and bitwise reproducible
+    "pm": acc_pm,           # P3M, or plain particle-mesh with p3m=False
+    "tree": acc_tree,       # Barnes-Hut, refit between steps by a State
+}
+
 class Object:
     def __init__(self, mass, density, position, velocity=[0,0,0], 
-                 name=None, color=None):
+                 name=None, color=None, test=False):
         self.exists = True
         self.mass = mass
         self.density = density
         self.position = np.array(position).astype(float)
         self.velocity = np.array(velocity).astype(float)
-        self.name = name or prnc.generate_word()
-        self.color = color or (int(255*random.random()),int(255*random.random()),int(255*random.random()))
+        # Left as None, a body is named and colored from its id once it is 
+        # part of a State
+        self.name = name
+        self.color = color
+        # Test particles feel gravity but don't exert it
+        self.test = test
         
     def get_volume(self):
         return self.mass/self.density
@@ -53,11 +74,17 @@ class Object:
         self.position = np.array([0.0,0.0,0.0])
         
     def create_satellite(self, distance=None, mass=None, density=None, 
-                         theta=None, name=None, color=None, G=_G):
-        distance = distance or random.randint(int(self.radius*5), int(self.radius*100))
-        mass = mass or random.random()*self.mass
+                         theta=None, name=None, color=None, G=_G, rng=None):
+        # Whatever isn't given is drawn from rng, which should be the run's
+        # own generator (Universe.rng) so that seeded runs stay reproducible
+        if rng is None and not (distance and mass and theta):
+            raise ValueError("Pass rng=universe.rng to draw a satellite's "
+                             "distance, mass or angle")
+        radius = self.get_radius()
+        distance = distance or int(rng.integers(int(radius*5), int(radius*100)))
+        mass = mass or rng.random()*self.mass
         density = density or self.density
-        theta = theta or 2*math.pi*random.random()
+        theta = theta or 2*math.pi*rng.random()
         v_mag = math.sqrt((self.mass*G)/distance) # Circular orbit
         pos = F.to_cartesian(distance, theta)
         pos_norm = pos/np.linalg.norm(pos)
@@ -70,60 +97,437 @@ class Object:
 
 class State:
     
-    def __init__(self, objects, dt=1, G=_G, iteration=0):
-        self.objects = objects
+    # Per-body arrays, kept aligned whenever bodies are added, removed or 
+    # reordered
+    fields = ("ids", "mass", "density", "position", "velocity", "frozen", 
+              "test")
+    
+    def __init__(self, objects=(), dt=1, G=_G, iteration=0, escape=None, 
+                 r_max=100*AU, escape_action="remove", seed=None, 
+                 reproducible=False, collision_skin=None, force="blas", 
+                 force_options=None, potentials=(), continuous_collisions=False,
+                 regularize=False, encounter_eta=0.02, max_substeps=10000,
+                 reorder_every=0):
+        if isinstance(force, str) and force not in FORCES and force != "auto":
+            raise ValueError(f"Unknown force backend: {force}")
+        if escape not in (None, "radius", "energy"):
+            raise ValueError(f"Unknown escape criterion: {escape}")
+        if escape == "radius" and r_max is None:
+            raise ValueError("The radius escape criterion needs an r_max")
+        if escape_action not in ("remove", "freeze"):
+            raise ValueError(f"Unknown escape action: {escape_action}")
         self.dt = dt
         self.G = G
         self.iteration = iteration
+        self.escape = escape
+        self.r_max = r_max
+        self.escape_action = escape_action
+        # One generator for everything random in a run; the seed also fixes
+        # the generated body names and colors. Without one a seed is drawn,
+        # so unseeded runs differ but can still be repeated from state.seed
+        if seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1)[0])
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        # Pin the summation order of the force and merge stages so that runs
+        # with the same seed are bitwise identical
+        self.reproducible = reproducible
+        self.collision_skin = collision_skin
+        # Swept-sphere collision detection, so fast bodies can't tunnel 
+        # through each other within a step
+        self.continuous_collisions = continuous_collisions
+        # Sub-step close pairs and small groups on their own, so a binary 
+        # doesn't force the whole system down to its timescale
+        self.regularize = regularize
+        self.encounter_eta = encounter_eta
+        self.max_substeps = max_substeps
+        # Sort the body arrays along a Morton curve every reorder_every 
+        # steps (0 never), so that bodies close in space are close in memory.
+        # Off by default: only the P3M short-range sum was measured to gain
+        # (~10%), and whole steps no measurable amount
+        self.reorder_every = reorder_every
+        # Number of groups sub-stepped in the last step
+        self.encounters = 0
+        # Mergers of the last step, as rows of cosmosim.core.events.MERGE_COLUMNS
+        self.events = []
+        self.force = force
+        self.force_options = force_options or {}
+        # With force="auto" the options configure the Autotuner instead: 
+        # candidates, tolerance, cache, and per-backend options keyed by name
+        self.autotuner = Autotuner(**self.force_options) if force == "auto" else None
+        # External fields (cosmosim.util.potentials) added to the pairwise 
+        # forces; plain functions f(positions, G) are accepted too
+        self.potentials = [p if hasattr(p, "acceleration") else Callable(p) 
+                           for p in potentials]
+        if escape == "energy" and not all(getattr(p, "has_potential", True) 
+                                          for p in self.potentials):
+            raise ValueError("The energy escape criterion needs a potential "
+                             "function for every external field")
+        self.neighbors = VerletList(collision_skin)
+        # Octree reused across steps by the "tree" backend
+        self.tree = None
+        # (iteration, id, mass, position, velocity) of every escaped body
+        self.escaped = []
+        self.next_id = 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.mass = np.zeros(0)
+        self.density = np.zeros(0)
+        self.position = np.zeros((0, 3))
+        self.velocity = np.zeros((0, 3))
+        self.frozen = np.zeros(0, dtype=bool)
+        self.test = np.zeros(0, dtype=bool)
+        # Only explicitly chosen names and colors are stored, keyed by id
+        self.names = {}
+        self.custom_colors = {}
+        self.add_objects(objects)
+        
+    def __len__(self):
+        return self.ids.size
+    
+    def __getstate__(self):
+        # The neighbor list and tree are only caches, keep them out of 
+        # saved frames
+        state = self.__dict__.copy()
+        state["neighbors"] = None
+        state["tree"] = None
+        return state
+    
+    def add_objects(self, objects):
+        objects = list(objects)
+        if not objects:
+            return self.ids[:0]
+        return self.add_bodies(mass=[o.mass for o in objects],
+                               density=[o.density for o in objects],
+                               position=[o.position for o in objects],
+                               velocity=[o.velocity for o in objects],
+                               names=[o.name for o in objects],
+                               colors=[o.color for o in objects],
+                               test=[o.test for o in objects])
+    
+    def add_bodies(self, mass, density, position, velocity=None, names=None, 
+                   colors=None, test=False):
+        position = np.asarray(position, dtype=float).reshape(-1, 3)
+        n = len(position)
+        if velocity is None:
+            velocity = np.zeros((n, 3))
+        ids = np.arange(self.next_id, self.next_id + n, dtype=np.int64)
+        self.next_id += n
+        if names is not None:
+            self.names.update((int(i), name) for i, name in zip(ids, names) if name)
+        if colors is not None:
+            self.custom_colors.update((int(i), tuple(color)) for i, color 
+                                      in zip(ids, colors) if color is not None)
+        new = {
+            "ids": ids,
+            "mass": np.broadcast_to(np.asarray(mass, dtype=float), (n,)),
+            "density": np.broadcast_to(np.asarray(density, dtype=float), (n,)),
+            "position": position,
+            "velocity": np.asarray(velocity, dtype=float).reshape(n, 3),
+            "frozen": np.zeros(n, dtype=bool),
+            "test": np.broadcast_to(np.asarray(test, dtype=bool), (n,))
+        }
+        for field in self.fields:
+            setattr(self, field, np.concatenate([getattr(self, field), new[field]]))
+        self.invalidate_caches()
+        return ids
+    
+    def select(self, index):
+        # Keep (and reorder) bodies by boolean mask or index array
+        for field in self.fields:
+            setattr(self, field, getattr(self, field)[index])
+        self.invalidate_caches()
+        
+    def reorder(self):
+        # Ids travel with the bodies, so names, colors and saved tracks are
+        # unaffected; only the cached neighbor pairs need rebuilding
+        self.select(morton_order(self.position))
+        
+    def invalidate_caches(self):
+        # Called whenever bodies are added, removed or reordered
+        if self.neighbors is not None:
+            self.neighbors.invalidate()
+        if self.tree is not None:
+            self.tree.invalidate()
         
     def masses(self):
-        return np.array([o.mass for o in self.objects])
+        return self.mass
     
     def radii(self):
-        return np.array([o.get_radius() for o in self.objects])
+        return ((3*self.mass/self.density)/(4*math.pi))**(1/3)
     
     def positions(self):
-        return np.array([o.position for o in self.objects])
+        return self.position
     
     def velocities(self):
-        return np.array([o.velocity for o in self.objects])
+        return self.velocity
     
     def colors(self):
-        return [o.color for o in self.objects]
+        colors = F.id_colors(self.ids, self.seed)
+        if self.custom_colors:
+            keys = np.fromiter(self.custom_colors, dtype=np.int64)
+            values = np.array([self.custom_colors[k] for k in keys.tolist()])
+            order = np.argsort(keys)
+            loc = np.searchsorted(keys[order], self.ids).clip(0, keys.size - 1)
+            hit = keys[order][loc] == self.ids
+            colors[hit] = values[order][loc[hit]]
+        return colors
+    
+    def name(self, body_id):
+        # Generated on demand, always the same for a given id and seed
+        body_id = int(body_id)
+        if body_id in self.names:
+            return self.names[body_id]
+        import cosmosim.util.pronounceable.main as prnc
+        return prnc.word_from_id(body_id, self.seed)
+    
+    def escapers(self, m, p, v, test):
+        # Measured relative to the centre of mass of the bodies still in 
+        # play, which test particles don't contribute to
+        m = np.where(test, 0.0, m)
+        M = m.sum()
+        if M > 0:
+            p_com = np.sum(m[:,None]*p, axis=0)/M
+            v_com = np.sum(m[:,None]*v, axis=0)/M
+        else:
+            # Only test particles left: measure from the origin
+            p_com = v_com = np.zeros(3)
+        dp = p - p_com
+        d = np.linalg.norm(dp, axis=1)
+        if self.r_max is not None:
+            mask = d > self.r_max
+        else:
+            mask = np.ones(m.size, dtype=bool)
+        if self.escape == "energy":
+            # Treat the rest of the system as a point mass at the centre of 
+            # mass, which is accurate for the distant bodies we care about
+            dv = v - v_com
+            potential = -self.G*np.divide(M - m, d, out=np.full(m.size, np.inf), 
+                                          where=d > 0)
+            # External fields hold bodies too, e.g. a star replaced by a
+            # PointMass. They are fixed in space, so velocities are then 
+            # measured in their frame.
+            if self.potentials:
+                dv = v
+            for field in self.potentials:
+                potential = potential + field.potential(p, self.G)
+            kinetic = 0.5*np.einsum('ij,ij->i', dv, dv)
+            mask &= kinetic + potential > 0
+        return mask
+    
+    def handle_escapes(self):
+        active = np.flatnonzero(~self.frozen)
+        if active.size == 0:
+            return
+        mask = self.escapers(self.mass[active], self.position[active], 
+                             self.velocity[active], self.test[active])
+        escaped = active[mask]
+        if escaped.size == 0:
+            return
+        for i in escaped:
+            self.escaped.append((self.iteration, self.ids[i], self.mass[i], 
+                                 self.position[i].copy(), self.velocity[i].copy()))
+        if self.escape_action == "freeze":
+            self.frozen[escaped] = True
+            self.velocity[escaped] = 0.0
+            self.invalidate_caches()
+        else:
+            keep = np.ones(len(self), dtype=bool)
+            keep[escaped] = False
+            self.select(keep)
+            
+    def absorb(self, i, j, t=1.0):
+        # Inelastic collision: the heavier body absorbs the lighter one, and 
+        # massive bodies always absorb test particles. Returns the indices of
+        # the survivor and of the absorbed body.
+        m, rho, p, v = self.mass, self.density, self.position, self.velocity
+        test = self.test
+        if test[i] != test[j]:
+            if test[i]:
+                i, j = j, i
+        elif m[i] < m[j]:
+            i, j = j, i
+        self.events.append((self.iteration, t, self.ids[i], self.ids[j], m[i], 
+                            m[j], p[i].copy(), p[j].copy(), v[j] - v[i]))
+        m_total = m[i] + m[j]
+        p[i] = ((m[i]*p[i])+(m[j]*p[j]))/m_total
+        v[i] = ((m[i]*v[i])+(m[j]*v[j]))/m_total
+        rho[i] = ((m[i]*rho[i])+(m[j]*rho[j]))/m_total
+        m[i] = m_total
+        return i, j
+    
+    def merge(self, pairs):
+        # Collisions at the end of the step, processed in pair order
+        alive = np.ones(len(self), dtype=bool)
+        for i, j in pairs:
+            if alive[i] and alive[j]:
+                survivor, absorbed = self.absorb(i, j)
+                alive[absorbed] = False
+        if not alive.all():
+            self.select(alive)
+            
+    def merge_continuous(self, i, j, t, candidates):
+        # Collisions during the step, earliest contact first. Bodies move in 
+        # straight lines within a step, so a merged body carries on from the 
+        # contact point along the combined momentum: its end position is 
+        # just the centre of mass of the pair's end positions. Later contacts
+        # involving it are recomputed along that new path.
+        p, v, dt, ids = self.position, self.velocity, self.dt, self.ids
+        radii = self.radii()
+        n = len(self)
+        alive = np.ones(n, dtype=bool)
+        version = np.zeros(n, dtype=int)
+        since = np.zeros(n)
+        partners = defaultdict(set)
+        for a, b in zip(*candidates):
+            partners[a].add(b)
+            partners[b].add(a)
+        events = [(t[k], ids[i[k]], ids[j[k]], i[k], j[k], 0, 0) 
+                  for k in range(len(t))]
+        heapq.heapify(events)
+        while events:
+            tc, _, _, a, b, va, vb = heapq.heappop(events)
+            if not (alive[a] and alive[b]) or version[a] != va or version[b] != vb:
+                continue
+            survivor, absorbed = self.absorb(a, b, tc)
+            alive[absorbed] = False
+            version[survivor] += 1
+            since[survivor] = tc
+            radii[survivor] = ((3*self.mass[survivor]/self.density[survivor])/(4*math.pi))**(1/3)
+            for k in partners.pop(absorbed):
+                partners[k].discard(absorbed)
+                if k != survivor:
+                    partners[k].add(survivor)
+                    partners[survivor].add(k)
+            # New contact times for the survivor's new path
+            for k in partners[survivor]:
+                if not alive[k] or (self.test[k] and self.test[survivor]):
+                    continue
+                d1 = p[survivor] - p[k]
+                e = (v[survivor] - v[k])*dt
+                tk = contact_times((d1 - e)[None], e[None], 
+                                   radii[survivor] + radii[k], 
+                                   max(since[survivor], since[k]))[0]
+                if not np.isnan(tk):
+                    lo, hi = sorted((survivor, k), key=lambda x: ids[x])
+                    heapq.heappush(events, (tk, ids[lo], ids[hi], lo, hi, 
+                                            version[lo], version[hi]))
+        if not alive.all():
+            self.select(alive)
+    
+    def accelerations(self, p, m, test=None):
+        if len(p) == 0:
+            return np.zeros((0, 3))
+        if test is not None and test.any():
+            # Only the k massive bodies pull: O(k^2) among themselves plus 
+            # O(k*n) onto the test particles
+            massive = ~test
+            a = np.empty_like(p)
+            a[massive] = self.accelerations(p[massive], m[massive])
+            a[test] = acc_direct(p[massive], m[massive], self.G, targets=p[test])
+            return a
+        if self.reproducible:
+            return acc_direct(p, m, self.G)
+        if self.force == "auto":
+            force = self.autotuner.choose(p, m, self.backend_accelerations, self.G)
+            return self.backend_accelerations(force, p, m)
+        return self.backend_accelerations(self.force, p, m)
+    
+    def backend_accelerations(self, force, p, m):
+        if self.autotuner is not None:
+            options = self.autotuner.options.get(force, {})
+        else:
+            options = self.force_options
+        if force == "tree":
+            if self.tree is None:
+                self.tree = Octree(**options)
+            return self.tree.accelerations(p, m, self.G)
+        force = FORCES[force] if isinstance(force, str) else force
+        return force(p, m, self.G, **options)
+    
+    def integrate_encounters(self, p0, v0, m, test, ids, p, v):
+        # Replace the global update of close groups (in p and v) by their own
+        # sub-stepped integration. Forces from outside the group are held at 
+        # their start-of-step value, summed directly rather than taken from 
+        # the global forces, which may come from an approximate backend 
+        # whose group term wouldn't cancel exactly.
+        groups = encounters.close_groups(p0, m, test, self.G, self.dt, 
+                                         self.encounter_eta)
+        for g in groups:
+            outside = ~test
+            outside[g] = False
+            sources = np.flatnonzero(outside)
+            if self.reproducible:
+                sources = sources[np.argsort(ids[sources], kind="stable")]
+            a_ext = acc_direct(p0[sources], m[sources], self.G, targets=p0[g])
+            for potential in self.potentials:
+                a_ext += potential.acceleration(p0[g], self.G)
+            p[g], v[g] = encounters.integrate_group(p0[g], v0[g], m[g], test[g], 
+                                                    a_ext, self.G, self.dt, 
+                                                    self.encounter_eta, 
+                                                    self.max_substeps)
+        self.encounters = len(groups)
     
     def interact(self,  collisions=True):
-        m = self.masses()
-        r = self.radii()
-        v0 = self.velocities()
-        p0 = self.positions()
+        self.events = []
+        active = np.flatnonzero(~self.frozen)
+        if active.size == 0:
+            self.iteration += 1
+            return
+        m = self.mass[active]
+        r = self.radii()[active]
+        v0 = self.velocity[active]
+        p0 = self.position[active]
+        test = self.test[active]
         
         # Calculate net accelerations
-        a = acc_blas(p0, m, self.G)  # Magic!!!
+        if self.reproducible:
+            # Always sum in id order, whatever the layout of the arrays
+            order = np.argsort(self.ids[active], kind="stable")
+            a = np.empty_like(p0)
+            a[order] = self.accelerations(p0[order], m[order], test[order])
+        else:
+            a = self.accelerations(p0, m, test)
+        for potential in self.potentials:
+            a += potential.acceleration(p0, self.G)
         # Integration
         v = v0 + a*self.dt
         p = p0 + v*self.dt
+        if self.regularize:
+            self.integrate_encounters(p0, v0, m, test, self.ids[active], p, v)
+        self.velocity[active] = v
+        self.position[active] = p
         
         if collisions:
-            d = pairwise_distances(p, n_jobs=-1, force_all_finite=True)
-            collision_matrix = d <= np.add.outer(r,r)
-        
-        # Update objects
-        absorbed = []
-        for i, obj in enumerate(self.objects):
-            if obj.exists:
-                obj.velocity = v[i]
-                obj.position = p[i]
-                if collisions:
-                    for j, c in enumerate(collision_matrix[i]):
-                        if c and i != j:
-                            other_obj = self.objects[j]
-                            if obj.mass >= other_obj.mass:
-                                obj.absorb(other_obj)
-                                absorbed.append(other_obj)
-        for obj in absorbed:
-            if obj in self.objects:
-                self.objects.remove(obj)
+            if self.neighbors is None:
+                self.neighbors = VerletList(self.collision_skin)
+            if self.continuous_collisions:
+                i, j, t = self.neighbors.swept_collisions(p0, p, r, v, self.dt)
+            else:
+                i, j = self.neighbors.collisions(p, r, v, self.dt)
+            # Test particles only collide with massive bodies
+            if i.size and test.any():
+                keep = ~(test[i] & test[j])
+                i, j = i[keep], j[keep]
+                if self.continuous_collisions:
+                    t = t[keep]
+            if i.size and self.continuous_collisions:
+                candidates = (active[self.neighbors.i], active[self.neighbors.j])
+                self.merge_continuous(active[i], active[j], t, candidates)
+            elif i.size:
+                i, j = active[i], active[j]
+                if self.reproducible:
+                    # Merge in order of body ids rather than array positions
+                    swap = self.ids[i] > self.ids[j]
+                    i, j = np.where(swap, j, i), np.where(swap, i, j)
+                    order = np.lexsort((self.ids[j], self.ids[i]))
+                    i, j = i[order], j[order]
+                self.merge(zip(i, j))
+        # Remove or freeze bodies that have left the system
+        if self.escape:
+            self.handle_escapes()
         self.iteration += 1
+        if self.reorder_every and self.iteration % self.reorder_every == 0:
+            self.reorder()
         
     def save(self, f):
         pickle.dump(self, f)
@@ -131,40 +535,85 @@ class State:
         
 class Universe:
     
-    def __init__(self, objects, dt, iterations, outpath=None, filesize=1000):
+    def __init__(self, objects, dt, iterations, outpath=None, filesize=1000, 
+                 stride=1, memory_budget=None, bus=None, **options):
+        # Every stride-th step is recorded, filesize frames to a file. Any 
+        # other keyword arguments configure the State: escape, r_max, 
+        # escape_action, seed, reproducible, collision_skin, force, ...
+        # With a memory_budget in bytes, run() adapts the force backend to 
+        # stay within it, or raises MemoryError (see cosmosim.core.memory). 
+        # Every recorded frame is also published to bus, a 
+        # cosmosim.core.framebus.FrameBus, if one is given
         self.objects = objects
         self.dt = dt
         self.iterations = iterations
         self.outpath = outpath
         self.filesize = filesize
+        self.stride = stride
+        self.memory_budget = memory_budget
+        self.bus = bus
+        self.state = State(objects, dt=dt, **options)
+        # Every merger of the run; written to outpath/events/ when saving
+        self.events = EventLog()
+        
+    @property
+    def rng(self):
+        return self.state.rng
+        
+    def add_bodies(self, **kwargs):
+        return self.state.add_bodies(**kwargs)
+    
+    def step(self, steps=1):
+        for i in range(steps):
+            self.state.interact()
+            self.events.append(self.state.events)
+            if self.bus is not None and self.state.iteration % self.stride == 0:
+                self.bus.publish(self.state)
                
-    def run(self):
-        state = State(self.objects, dt=self.dt)
-        nfiles = math.ceil(self.iterations/self.filesize)
+    def estimate_memory(self, record=True):
+        return memory.estimate(self, record)
+    
+    def run(self, progress=True, record=True):
+        # Without recording, only the final state is kept and returned. 
+        # Recording to disk returns the output path, in memory the states.
+        usage, changes = memory.plan(self, self.memory_budget, record)
+        if progress:
+            print(memory.report(usage))
+            for change in changes:
+                print(f"To fit the memory budget: {change}")
+        state = self.state
+        nframes = math.ceil(self.iterations/self.stride)
+        nfiles = math.ceil(nframes/self.filesize)
         elapsed = 0
-        if self.outpath:
+        if not record:
+            for i in progress_bar(range(self.iterations), desc="Running simulation", 
+                                  disable=not progress):
+                self.step()
+            return state
+        elif self.outpath:
             if not os.path.isdir(self.outpath):
                 os.mkdir(self.outpath)
             existing_filelist = os.listdir(self.outpath)
             for f in existing_filelist:
-                os.remove(self.outpath + f)
-            print(f"A total of {nfiles} data files will be created.")
+                if f.endswith(".dat"):
+                    os.remove(self.outpath + f)
+            self.events = EventLog(os.path.join(self.outpath, "events"))
+            if progress:
+                print(f"A total of {nfiles} data files will be created.")
             for n in range(nfiles): 
                 path = self.outpath + f"{n}.dat"
-                for i in tqdm(range(min(self.filesize, self.iterations)), desc=f"Writing file {n}"):
-                    state.interact(self.dt)
+                for i in progress_bar(range(min(self.filesize, nframes - elapsed)), 
+                                      desc=f"Writing file {n}", disable=not progress):
+                    self.step(min(self.stride, self.iterations - elapsed*self.stride))
                     with open(path, "ab+") as f:
                         state.save(f)
                     elapsed += 1
-                    if elapsed >= self.iterations:
-                        break
+            return self.outpath
         else:
             states = []
-            for i in tqdm(range(self.iterations), desc="Running simulation"):
-                state.interact()
+            for i in progress_bar(range(nframes), desc="Running simulation", 
+                                  disable=not progress):
+                self.step(min(self.stride, self.iterations - i*self.stride))
                 new_state = copy.deepcopy(state)
                 states.append(new_state)
             return states
-            
-    
-    
\ No newline at end of file
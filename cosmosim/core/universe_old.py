@@ -4,8 +4,10 @@ import random
 import math
 import cosmosim.util.functions as F
 from cosmosim.util.blas import acc_blas
+from cosmosim.util.tree import Octree
+from cosmosim.util.budget import FrameBudget, LEVELS
 from cosmosim.core.planet import Planet
-from sklearn.metrics import pairwise_distances
+from cosmosim.util.trails import Trails
 import time
 
 WHITE = (255,255,255)
@@ -29,6 +31,8 @@ class Universe:
         self.angular_momentum = 0.0
         self.total_energy = 0.0
         self.clicked_planet = None
+        self.tree = None
+        self.substeps = 1
         self.running = False
         self.paused = False
         self.dragging = False
@@ -147,7 +151,10 @@ class Universe:
                     self.clicked_planet = None
                 # Click on planet
                 else:
-                    clicked_planets = [p for p in self.get_active_planets() if np.linalg.norm(F.screen_coordinates(p.position, **self.context) - pos) <= max(p.radius*self.context['scale'],10.0)]
+                    planets = self.get_active_planets()
+                    q = F.project(np.array([p.position for p in planets]).reshape(-1, 2), F.camera(**self.context))
+                    hit = np.linalg.norm(q - pos, axis=1) <= np.maximum(np.array([p.radius for p in planets])*self.context['scale'], 10.0)
+                    clicked_planets = [p for p, h in zip(planets, hit) if h]
                     if len(clicked_planets) > 0:
                         if self.clicked_planet:
                             self.clicked_planet.clicked = False
@@ -163,52 +170,97 @@ class Universe:
         else:
             pass
     
+    def accelerations(self, p, m):
+        # Exact forces, or Barnes-Hut when the frame budget has had to
+        # coarsen them
+        theta = self.budget.theta
+        if theta is None:
+            a_3d = acc_blas(p, m, self.G)  # Magic!!!
+        else:
+            if self.tree is None or self.tree.theta != theta:
+                self.tree = Octree(theta=theta)
+            a_3d = self.tree.accelerations(np.column_stack([p, np.zeros(len(p))]), m, self.G)
+        return a_3d[:,:2]                   # Only need 2D acceleration
+    
+    def step(self, dt):
+        # Initial conditions
+        planets = self.active_planets
+        if not planets:
+            return
+        m = np.array([p.mass for p in planets], dtype=float)
+        p0 = np.array([p.position for p in planets])
+        v0 = np.array([p.velocity for p in planets])
+        # Integration
+        v = v0 + self.accelerations(p0, m)*dt
+        p = p0 + v*dt
+        for i, planet in enumerate(planets):
+            if not planet.immobile:
+                planet.velocity = v[i]
+                planet.position = p[i]
+        # Collisions
+        if self.collisions:
+            self.collide(planets)
+            self.active_planets = self.get_active_planets()
+            
+    def collide(self, planets):
+        # Only pairs closer than twice the largest radius can touch
+        from scipy.spatial import cKDTree
+        if len(planets) < 2:
+            return
+        p = np.array([planet.position for planet in planets])
+        radii = np.array([planet.radius for planet in planets])
+        pairs = cKDTree(p).query_pairs(2*radii.max(), output_type='ndarray')
+        pairs = pairs[np.lexsort((pairs[:,1], pairs[:,0]))]
+        i, j = pairs[:,0], pairs[:,1]
+        touching = np.linalg.norm(p[i] - p[j], axis=1) <= radii[i] + radii[j]
+        for i, j in pairs[touching].tolist():
+            planet, other_planet = planets[i], planets[j]
+            if planet.mass >= other_planet.mass:
+                planet.absorb(other_planet)
+            else:
+                other_planet.absorb(planet)
+                
+    def update_diagnostics(self):
+        # Energies and angular momentum, O(n^2), so once per frame at most
+        planets = self.active_planets
+        if not planets:
+            return
+        m = np.array([planet.mass for planet in planets], dtype=float)
+        p = np.array([planet.position for planet in planets])
+        v = np.array([planet.velocity for planet in planets])
+        # Calculate energies
+        from sklearn.metrics import pairwise_distances
+        d = np.clip(pairwise_distances(p, n_jobs=-1), 1, None)
+        d_inv = np.reciprocal(d, where=(d!=0))
+        v_mag = np.linalg.norm(v.astype(float), axis=1)
+        V = -self.G*m*d_inv
+        np.fill_diagonal(V, 0.0)
+        U = m*np.sum(V, axis=1)
+        K = 0.5*m*np.square(v_mag)
+        self.total_energy = np.sum(K + U)
+        # Calculate angular momenta
+        self.angular_momentum = np.sum(m*np.cross(p,v))
+        for planet, energy in zip(planets, K + U):
+            planet.energy = energy
+    
     def interact(self):
-        # Calculations
+        # As many physics steps as fit in the frame budget, splitting the 
+        # frame's dt between them
         if not self.paused:
-            # Initial conditions
-            m = np.array([p.mass for p in self.active_planets])
-            p0 = np.array([p.position for p in self.active_planets])
-            v0 = np.array([p.velocity for p in self.active_planets])
-            # Calculate net accelerations
-            a_3d = acc_blas(p0, m, self.G)  # Magic!!!
-            a = np.delete(a_3d, 2, 1)       # Only need 2D acceleration
-            # Integration
-            v = v0 + a*self.dt
-            p = p0 + v*self.dt
-            # Calculate energies
-            d = np.clip(pairwise_distances(p, n_jobs=-1), 1, None)
-            d_inv = np.reciprocal(d, where=(d!=0))
-            v_mag = np.linalg.norm(v.astype(float), axis=1)
-            V = -self.G*m*d_inv
-            np.fill_diagonal(V, 0.0)
-            U = m*np.sum(V, axis=1)
-            K = 0.5*m*np.square(v_mag)
-            self.total_energy = np.sum(K + U)
-            # Calculate angular momenta
-            self.angular_momentum = np.sum(m*np.cross(p,v))
-            # Identify collisions
-            if self.collisions:
-                radii = np.array([p.radius for p in self.active_planets])
-                collision_matrix = d <= np.add.outer(radii,radii)
-            
-        # Update planets 
-        for i, planet in enumerate(self.active_planets):
-            if not self.paused:
-                if planet.alive:
-                    if not planet.immobile:
-                        planet.velocity = v[i]
-                        planet.position = p[i]
-                    if self.collisions:
-                        for j, c in enumerate(collision_matrix[i]):
-                            if c and i != j:
-                                other_planet = self.active_planets[j]
-                                if planet.mass >= other_planet.mass:
-                                    planet.absorb(other_planet)
-                                else:
-                                    other_planet.absorb(planet)
-                    planet.energy =  K[i] + U[i]
-                planet.update_history(self.trail_length)
+            self.substeps = self.budget.substeps()
+            for k in range(self.substeps):
+                start = time.perf_counter()
+                self.step(self.dt/self.substeps)
+                self.budget.measure(time.perf_counter() - start)
+            if self.budget.diagnostics:
+                self.update_diagnostics()
+        # Tracked planets' trails, indexed by position in self.planets
+        if not self.paused:
+            tracked = [k for k, planet in enumerate(self.planets) if planet.alive and planet.tracked]
+            self.trails.record(tracked, [self.planets[k].position for k in tracked])
+        self.trails.draw(self.screen, F.camera(**self.context), 
+                         range(len(self.planets)), [p.color for p in self.planets])
+        for planet in self.active_planets:
             planet.draw(self.screen, planet.color)
                  
     def update_universe_info_text(self):
@@ -302,14 +354,25 @@ class Universe:
         speed_text = "Speed: %.2f" % round(self.speed,1)
         speed_img = self.font.render(speed_text, True, WHITE)
         self.screen.blit(speed_img, (self.width*0.90, 60))
+        # Substeps per frame, and what is being skipped to keep up
+        budget_text = "Substeps: %i" % self.substeps
+        if self.budget.level:
+            budget_text += " (%s)" % self.budget.name
+        budget_img = self.font.render(budget_text, True, WHITE)
+        self.screen.blit(budget_img, (self.width*0.90, 80))
     
     def simulate(self, width=1600, height=1000, speed=1e6, fps=33, 
                  trail_length=1000, collisions=True, 
                  track_all=False, run_while=(lambda x: True), 
-                 scale=1e-7, start_paused=False):
+                 scale=1e-7, start_paused=False, budget=True, max_substeps=16):
+        # budget: fit the physics to the frame rate, with up to max_substeps
+        #         substeps per frame, coarser forces and no diagnostics or 
+        #         HUD text when even one step doesn't fit (see 
+        #         cosmosim.util.budget); otherwise one exact step per frame
         # Configure simulation
         self.collisions = collisions
         self.trail_length = trail_length
+        self.trails = Trails(trail_length, capacity=len(self.planets))
         self.default_scale = scale
         self.width = width
         self.height = height
@@ -317,6 +380,10 @@ class Universe:
         self.speed = speed
         self.dt_default = speed/fps
         self.dt = self.dt_default
+        if budget:
+            self.budget = FrameBudget(fps, max_substeps)
+        else:
+            self.budget = FrameBudget(fps, 1, levels=LEVELS[:1])
         self.paused = start_paused
         if track_all:
             for p in self.planets:
@@ -336,6 +403,7 @@ class Universe:
         # Run simulation
         self.running = True
         while self.running and run_while(self):
+            start = time.perf_counter()
             # Clear the screen
             self.screen.fill(BLACK)
             # Handle user inputs
@@ -348,14 +416,19 @@ class Universe:
             # Destroy escaped planets
             if self.bounded:
                 self.destroy_escaped_planets()
-            # Update universe info text
-            self.update_universe_info_text()
-            # Update clicked planet text
-            self.update_clicked_planet_text()
+            if self.budget.hud:
+                # Update universe info text
+                self.update_universe_info_text()
+                # Update clicked planet text
+                self.update_clicked_planet_text()
+            else:
+                # Its buttons aren't on screen
+                self.close_btn = self.track_btn = self.destroy_btn = None
             # Update simulation text
             self.update_simulation_text()
             # Refresh display
             pygame.display.flip()
+            self.budget.end_frame(time.perf_counter() - start)
             self.clock.tick(fps)
             # Update iterations
             self.iterations += 1
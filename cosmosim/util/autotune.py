@@ -0,0 +1,140 @@
+import os
+import json
+import math
+import time
+import platform
+import numpy as np
+from cosmosim.util.direct import acc_direct
+
+# =============================================================================
+# Force backend autotuning (State(force="auto")). The candidate backends are
+# timed on the actual bodies and the fastest one is used until the number of
+# bodies leaves its size bucket, e.g. after many mergers or escapes. A
+# decision is cached on disk per machine and bucket, so later runs of a
+# similar size skip the benchmark.
+#
+# Only exact backends are candidates by default, so "auto" never changes
+# the physics. Approximate ones ("tree", "pm") are opt-in, with a
+# tolerance: the median relative force error they may make against a
+# direct sum on a sample of the bodies.
+# =============================================================================
+
+DEFAULT_CANDIDATES = ("blas", "direct")
+APPROXIMATE = ("tree", "pm")
+
+# Bodies the approximate backends are checked on
+ERROR_SAMPLE = 256
+
+# acc_blas keeps 3 packed n x n complex matrices, 24*n^2 bytes
+BLAS_MAX_BODIES = 6000
+
+# Buckets are half an octave wide, so n can change by ~40% before retuning
+BUCKETS_PER_OCTAVE = 2
+
+def cache_path():
+    root = os.environ.get("COSMOSIM_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "cosmosim")
+    return os.path.join(root, "autotune.json")
+
+def machine_key():
+    return f"{platform.node()}-{platform.machine()}-{os.cpu_count()}cpu"
+
+def bucket(n):
+    return int(round(BUCKETS_PER_OCTAVE*math.log2(max(n, 1))))
+
+def force_error(a, p, m, G=1, sample=ERROR_SAMPLE):
+    # Median relative error of accelerations a against a direct sum, on an
+    # evenly spaced sample of the bodies
+    targets = np.unique(np.linspace(0, len(p) - 1, min(sample, len(p))).astype(int))
+    exact = acc_direct(p, m, G, targets=p[targets])
+    norm = np.linalg.norm(exact, axis=1)
+    ok = norm > 0
+    if not ok.any():
+        return 0.0
+    return float(np.median(np.linalg.norm(a[targets] - exact, axis=1)[ok]/norm[ok]))
+
+def _time(f, repeat):
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+class Autotuner:
+
+    def __init__(self, candidates=DEFAULT_CANDIDATES, tolerance=None, 
+                 cache=None, repeat=3, **options):
+        # tolerance: largest median relative force error allowed, required
+        #            with approximate candidates
+        # cache: path of the decision file, False to always benchmark
+        # options: per-backend force options, e.g. tree={"theta": 0.7}
+        self.candidates = tuple(candidates)
+        if tolerance is None and any(c in APPROXIMATE for c in self.candidates):
+            raise ValueError("Approximate force candidates need a tolerance, "
+                             "e.g. tolerance=0.01")
+        self.tolerance = tolerance
+        self.cache = cache_path() if cache is None else cache
+        self.repeat = repeat
+        self.options = options
+        self.bucket = None
+        self.choice = None
+        self.timings = {}
+        self.errors = {}
+
+    def choose(self, p, m, evaluate, G=1):
+        # Backend name for these bodies. evaluate(name, p, m) runs a backend
+        # the way the State would, so stateful ones (the tree) are timed in
+        # their steady state.
+        if bucket(len(p)) == self.bucket:
+            return self.choice
+        self.bucket = bucket(len(p))
+        cached = self.load().get(self.key())
+        if cached:
+            self.choice, self.timings = cached["force"], cached["seconds"]
+            self.errors = cached.get("errors", {})
+            return self.choice
+        self.timings, self.errors = {}, {}
+        for name in self.candidates:
+            if name == "blas" and len(p) > BLAS_MAX_BODIES:
+                continue
+            a = evaluate(name, p, m)    # Warm up: imports, tree build, FFT plans
+            if name in APPROXIMATE:
+                self.errors[name] = force_error(a, p, m, G)
+                if self.errors[name] > self.tolerance:
+                    continue
+            self.timings[name] = _time(lambda: evaluate(name, p, m), self.repeat)
+        if not self.timings:
+            # Nothing was accurate enough, or could run at this size
+            self.timings["direct"] = _time(lambda: evaluate("direct", p, m), self.repeat)
+        self.choice = min(self.timings, key=self.timings.get)
+        self.save()
+        return self.choice
+
+    def key(self):
+        # Decisions only hold for the same candidates, options and tolerance
+        options = json.dumps(self.options, sort_keys=True, default=str)
+        return f"{'+'.join(self.candidates)}/{options}/{self.tolerance}/{self.bucket}"
+
+    def load(self):
+        if not self.cache or not os.path.isfile(self.cache):
+            return {}
+        try:
+            with open(self.cache) as f:
+                return json.load(f).get(machine_key(), {})
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        if not self.cache:
+            return
+        try:
+            with open(self.cache) as f:
+                table = json.load(f)
+        except (OSError, ValueError):
+            table = {}
+        table.setdefault(machine_key(), {})[self.key()] = {
+            "force": self.choice, "seconds": self.timings, "errors": self.errors}
+        os.makedirs(os.path.dirname(self.cache), exist_ok=True)
+        with open(self.cache, "w") as f:
+            json.dump(table, f, indent=2)
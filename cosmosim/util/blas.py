@@ -1,7 +1,7 @@
 import numpy as np
-from scipy.linalg.blas import zhpr, dspr2, zhpmv
 
 def acc_blas(pos, mas, G=1):
+    from scipy.linalg.blas import zhpr, dspr2, zhpmv
     n = mas.size
     # trick: use complex Hermitian to get the packed anti-symmetric
     # outer difference in the imaginary part of the zhpr answer
@@ -0,0 +1,118 @@
+# =============================================================================
+# Frame budgets for live simulation. A frame has 1/fps seconds. The time of
+# one physics step and the time of everything else in a frame (drawing, the
+# HUD, diagnostics) are tracked as moving averages, and the physics gets as
+# many substeps as fit in what the rest leaves over.
+#
+# When even a single step doesn't fit for a few frames in a row, the loop
+# drops a level: first the diagnostics go, then the HUD text, then exact
+# forces give way to Barnes-Hut at a growing opening angle. After a run of
+# frames with plenty of time to spare it moves back up a level; if that
+# doesn't last, it waits twice as long before trying again.
+# =============================================================================
+
+LEVELS = (  # name, diagnostics, HUD text, opening angle (None: exact forces)
+    ("full", True, True, None),
+    ("no diagnostics", False, True, None),
+    ("no HUD", False, False, None),
+    ("tree", False, False, 0.5),
+    ("coarse tree", False, False, 1.0),
+)
+
+
+class FrameBudget:
+
+    def __init__(self, fps, max_substeps=16, levels=LEVELS, smoothing=0.2,
+                 headroom=0.5, grace=3, patience=60):
+        # smoothing: weight of the latest frame in the moving averages
+        # grace: frames over budget before dropping a level
+        # headroom, patience: a step and the rest of the frame must fit in
+        #                     that fraction of it for that many frames
+        #                     before moving back up
+        self.seconds = 1/fps
+        self.max_substeps = max_substeps
+        self.levels = levels
+        self.smoothing = smoothing
+        self.headroom = headroom
+        self.grace = grace
+        self.patience = patience
+        self.wait = patience
+        self.level = 0
+        self.warmup = 1
+        self.frames = 0
+        self.raised_at = None
+        self.late = 0
+        self.calm = 0
+        self.step_time = None
+        self.other_time = 0.0
+        self.steps = 0
+        self.stepped = 0.0
+
+    @property
+    def name(self):
+        return self.levels[self.level][0]
+
+    @property
+    def diagnostics(self):
+        return self.levels[self.level][1]
+
+    @property
+    def hud(self):
+        return self.levels[self.level][2]
+
+    @property
+    def theta(self):
+        return self.levels[self.level][3]
+
+    def substeps(self):
+        # Steps that fit in this frame, judging by the last ones
+        if self.step_time is None:
+            return 1
+        spare = self.seconds - self.other_time
+        return int(min(self.max_substeps, max(1, spare//self.step_time)))
+
+    def measure(self, seconds):
+        # Time of one physics step
+        self.steps += 1
+        self.stepped += seconds
+
+    def end_frame(self, seconds):
+        # Time of the whole frame, its steps included. Returns True if the
+        # level changed.
+        steps, stepped = self.steps, self.stepped
+        self.steps, self.stepped = 0, 0.0
+        self.frames += 1
+        if steps == 0:
+            # Paused
+            return False
+        if self.warmup:
+            # The first frame at a level pays for imports, fonts and tree
+            # builds, and says little about the ones after it
+            self.warmup -= 1
+            return False
+        self.other_time += self.smoothing*(seconds - stepped - self.other_time)
+        if self.step_time is None:
+            self.step_time = stepped/steps
+        else:
+            self.step_time += self.smoothing*(stepped/steps - self.step_time)
+        single = self.step_time + self.other_time
+        self.late = self.late + 1 if single > self.seconds else 0
+        self.calm = self.calm + 1 if single < self.headroom*self.seconds else 0
+        if self.late >= self.grace and self.level < len(self.levels) - 1:
+            # Moving up didn't last: be slower to try it again
+            if self.raised_at is not None and self.frames - self.raised_at < self.wait:
+                self.wait *= 2
+            return self.set_level(self.level + 1)
+        if self.calm >= self.wait and self.level > 0:
+            self.raised_at = self.frames
+            return self.set_level(self.level - 1)
+        return False
+
+    def set_level(self, level):
+        # Step costs change with the level, so they are measured afresh
+        self.level = level
+        self.warmup = 1
+        self.step_time = None
+        self.late = 0
+        self.calm = 0
+        return True
@@ -0,0 +1,32 @@
+import numpy as np
+
+def acc_direct(pos, mas, G=1, targets=None, tile=256):
+    # Plain pairwise sum of the accelerations that the bodies at pos exert on
+    # targets (the bodies themselves by default), tiled over the targets to 
+    # bound memory at tile*n*3 doubles.
+    # Every sum runs over the sources in array order in single-threaded 
+    # NumPy, so the result is bitwise reproducible, unlike the BLAS kernels.
+    if targets is None:
+        targets = pos
+    out = np.empty((len(targets), 3))
+    for start in range(0, len(targets), tile):
+        t = targets[start:start+tile]
+        d = pos[None,:,:] - t[:,None,:]
+        r2 = np.sum(d*d, axis=2)
+        # Coincident pairs (including each body with itself) don't interact
+        inv_r3 = np.zeros_like(r2)
+        np.divide(1.0, r2*np.sqrt(r2), out=inv_r3, where=r2 > 0)
+        out[start:start+tile] = np.sum((inv_r3*mas)[:,:,None]*d, axis=1)
+    return G*out
+
+def acc_batched(pos, mas, G=1):
+    # Direct sum over a batch of independent systems with the same number of
+    # bodies: pos (B, n, 3) and mas (B, n) give (B, n, 3). Memory goes as 
+    # B*n^2, so this is meant for many small systems at once. G may be a 
+    # scalar or one value per system.
+    d = pos[:,None,:,:] - pos[:,:,None,:]
+    r2 = np.sum(d*d, axis=3)
+    inv_r3 = np.zeros_like(r2)
+    np.divide(1.0, r2*np.sqrt(r2), out=inv_r3, where=r2 > 0)
+    G = np.asarray(G, dtype=float).reshape(-1, 1, 1)
+    return G*np.sum((inv_r3*mas[:,None,:])[:,:,:,None]*d, axis=2)
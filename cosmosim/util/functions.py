@@ -8,31 +8,37 @@ def normalize(v):
        return v
     return v / norm
 
+# Vector functions take a single vector or an (n, 2|3) array of them
+
 def to_cartesian(r, theta, origin=[0,0]):
     y = r*np.sin(theta) + origin[0]
     x = r*np.cos(theta) + origin[1]
-    return [y,x]
+    return np.stack([y,x], axis=-1)
 
 def to_cartesian_3d(r, theta, phi, origin=[0,0,0]):
     y = r*np.sin(theta)*np.sin(phi) + origin[0]
     x = r*np.cos(theta)*np.sin(phi) + origin[1]
     z = r*np.cos(phi) + origin[2]
-    return [x,y,z]
+    return np.stack(np.broadcast_arrays(x,y,z), axis=-1)
 
-def rotation(v,theta):
-    R = np.array([[np.cos(theta), -np.sin(theta)],
-                  [np.sin(theta), np.cos(theta)]])
-    return np.matmul(R,v)
+def rotation_matrix(theta):
+    return np.array([[np.cos(theta), -np.sin(theta)],
+                     [np.sin(theta), np.cos(theta)]])
 
-def rotation_3d(v, theta, phi):
+def rotation_matrix_3d(theta, phi):
     Rtheta = np.array([[np.cos(theta), 0, np.sin(theta)],
                       [0,1,0],
                       [-np.sin(theta), 0, np.cos(theta)]])
     Rphi = np.array([[1, 0, 0],
                      [0, np.cos(phi), -np.sin(phi)],
                      [0, np.sin(phi), np.cos(phi)]])
-    R = np.matmul(Rtheta,Rphi)
-    return np.matmul(R,v)
+    return np.matmul(Rtheta,Rphi)
+
+def rotation(v,theta):
+    return np.asarray(v) @ rotation_matrix(theta).T
+
+def rotation_3d(v, theta, phi):
+    return np.asarray(v) @ rotation_matrix_3d(theta, phi).T
 
 def get_tangent(position, reference=[0,0]):
     R = np.array([[0,1],[-1,0]])
@@ -40,17 +46,49 @@ def get_tangent(position, reference=[0,0]):
     tangent = R @ normalize(dp)
     return tangent
 
+def hermite(p0, v0, p1, v1, T, s):
+    # Cubic Hermite interpolation at fraction s of a span of length T, 
+    # between positions p0, p1 with velocities v0, v1
+    s2, s3 = s*s, s*s*s
+    return ((2*s3 - 3*s2 + 1)*p0 + (s3 - 2*s2 + s)*T*v0 
+            + (3*s2 - 2*s3)*p1 + (s3 - s2)*T*v1)
+
 def get_radius(mass, density):
     volume = mass/density
     radius = ((3*volume)/(4*math.pi))**(1/3)
     return radius
 
+def id_colors(ids, seed=0):
+    # SplitMix64 finaliser: a cheap, well mixed hash of (seed, id), three 
+    # bytes of which make an RGB color
+    gamma = np.uint64(0x9E3779B97F4A7C15)
+    with np.errstate(over='ignore'):
+        x = (np.asarray(ids, dtype=np.uint64) + np.uint64(seed) + np.uint64(1))*gamma
+        x = (x ^ (x >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    return np.column_stack([(x >> np.uint64(s)) & np.uint64(255) for s in (0, 8, 16)]).astype(np.uint8)
+
+# Screen projection. A camera (matrix, shift) maps positions to pixels as
+# p @ matrix + shift; build it once per frame and project every body in one
+# call.
+
+def camera(scale, offset, origin, rotation=None):
+    # Flip y (screen rows grow downwards) and scale; in 3D rotate first and 
+    # drop z
+    flip = np.array([[1.0, 0.0], [0.0, -1.0]])*scale
+    if rotation is None:
+        matrix = flip.T
+    else:
+        matrix = (flip @ rotation_matrix_3d(*rotation)[:2]).T
+    return matrix, origin + offset*scale
+
+def project(p, camera):
+    matrix, shift = camera
+    return np.asarray(p) @ matrix + shift
+
 def screen_coordinates(p, scale, offset, origin):
-    return origin + (np.multiply(p,np.array([1,-1]))*scale)+(offset*scale)
+    return project(p, camera(scale, offset, origin))
 
 def screen_coordinates_3d(p, scale, offset, rotation, origin):
-    theta, phi = rotation
-    v0 = rotation_3d(p, theta, phi)
-    v1 = np.delete(v0, 2, 0)
-    v = origin + (np.multiply(v1,np.array([1,-1]))*scale)+(offset*scale)
-    return v
\ No newline at end of file
+    return project(p, camera(scale, offset, origin, rotation))
@@ -0,0 +1,98 @@
+import numpy as np
+
+def contact_times(d0, e, R, t_min=0.0):
+    # Earliest t in [t_min, 1] at which spheres whose separation moves as 
+    # d0 + e*t, with radii summing to R, touch; nan if they don't
+    d_min = d0 + e*t_min
+    touching = np.sum(d_min*d_min, axis=-1) <= R**2
+    a = np.sum(e*e, axis=-1)
+    b = 2*np.sum(d0*e, axis=-1)
+    c = np.sum(d0*d0, axis=-1) - R**2
+    disc = b**2 - 4*a*c
+    t = np.full(np.shape(a), np.nan)
+    ok = (a > 0) & (disc >= 0)
+    t[ok] = (-b[ok] - np.sqrt(disc[ok]))/(2*a[ok])
+    t[(t < t_min) | (t > 1)] = np.nan
+    return np.where(touching, t_min, t)
+
+class VerletList:
+    # Cached candidate collision pairs.
+    # The list holds every pair closer than 2*r_max + skin when it was built,
+    # so no pair outside of it can touch until some body has moved more than 
+    # skin/2. The smallest surface gap in the list also tells us when no pair
+    # in it can touch yet, and the detection pass can be skipped outright.
+    
+    def __init__(self, skin=None, skin_steps=10):
+        self.skin = skin
+        self.skin_steps = skin_steps
+        self.reference = None
+        self.builds = 0
+        
+    def build(self, p, r, v, dt):
+        from scipy.spatial import cKDTree
+        # Without a fixed skin, allow for skin_steps steps of the fastest body
+        v_max = np.sqrt(np.max(np.sum(v*v, axis=1))) if len(v) else 0.0
+        if self.skin is not None:
+            self.current_skin = self.skin
+        else:
+            self.current_skin = max(r.max(), self.skin_steps*v_max*abs(dt))
+        # A swept test also needs the start of the step inside the skin
+        self.current_skin = max(self.current_skin, 4*v_max*abs(dt))
+        cutoff = 2*r.max() + self.current_skin
+        pairs = cKDTree(p).query_pairs(cutoff, output_type='ndarray')
+        pairs = pairs[np.lexsort((pairs[:,1], pairs[:,0]))]
+        self.i, self.j = pairs[:,0], pairs[:,1]
+        gaps = self.distances(p) - (r[self.i] + r[self.j])
+        self.min_gap = gaps.min() if gaps.size else np.inf
+        self.reference = p.copy()
+        self.builds += 1
+        
+    def distances(self, p):
+        d = p[self.i] - p[self.j]
+        return np.sqrt(np.sum(d*d, axis=1))
+        
+    def invalidate(self):
+        self.reference = None
+        
+    def max_displacement(self, *positions):
+        d_max = 0.0
+        for p in positions:
+            d = p - self.reference
+            d_max = max(d_max, np.sqrt(np.max(np.sum(d*d, axis=1))))
+        return d_max
+        
+    def candidates(self, p, r, v, dt, p0=None):
+        # Index pairs (i < j) that may be touching at p, or anywhere on the 
+        # way from p0 to p, in lexicographic order
+        if len(p) < 2:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        positions = (p,) if p0 is None else (p0, p)
+        if self.reference is None or len(self.reference) != len(p):
+            self.build(p, r, v, dt)
+        d_max = self.max_displacement(*positions)
+        if 2*d_max > self.current_skin:
+            self.build(p, r, v, dt)
+            d_max = self.max_displacement(*positions)
+        # Every gap shrinks by at most 2*d_max since the build
+        if self.min_gap - 2*d_max > 0:
+            return self.i[:0], self.j[:0]
+        return self.i, self.j
+        
+    def collisions(self, p, r, v, dt):
+        # Pairs touching at the end of the step
+        i, j = self.candidates(p, r, v, dt)
+        if i.size == 0:
+            return i, j
+        touching = self.distances(p) <= r[i] + r[j]
+        return i[touching], j[touching]
+    
+    def swept_collisions(self, p0, p, r, v, dt):
+        # Pairs touching at any time during the step, assuming straight 
+        # paths from p0 to p, with the fraction of the step at first contact
+        i, j = self.candidates(p, r, v, dt, p0)
+        if i.size == 0:
+            return i, j, np.zeros(0)
+        d0 = p0[i] - p0[j]
+        t = contact_times(d0, (p[i] - p[j]) - d0, r[i] + r[j])
+        touching = ~np.isnan(t)
+        return i[touching], j[touching], t[touching]
@@ -0,0 +1,84 @@
+import numpy as np
+
+# =============================================================================
+# Fixed external potentials, for a dominant body (or a whole galaxy) that is
+# cheaper to model analytically than to include in the pairwise force sum.
+# Each one evaluates its acceleration on all bodies at once given an (n, 3)
+# array of positions and the gravitational constant.
+#
+# Saved frames are pickled along with their potentials, so a user-supplied
+# function should be defined at module level.
+# =============================================================================
+
+class Plummer:
+
+    def __init__(self, mass, scale_radius, center=(0,0,0)):
+        self.mass = mass
+        self.scale_radius = scale_radius
+        self.center = np.array(center, dtype=float)
+
+    def potential(self, pos, G):
+        d = pos - self.center
+        r2 = np.sum(d*d, axis=1) + self.scale_radius**2
+        return -G*self.mass/np.sqrt(r2)
+
+    def acceleration(self, pos, G):
+        d = pos - self.center
+        r2 = np.sum(d*d, axis=1) + self.scale_radius**2
+        inv_r3 = np.zeros_like(r2)
+        np.divide(1.0, r2*np.sqrt(r2), out=inv_r3, where=r2 > 0)
+        return -G*self.mass*inv_r3[:,None]*d
+
+
+class PointMass(Plummer):
+    # A Plummer sphere with no core, e.g. a star whose own motion we ignore
+
+    def __init__(self, mass, center=(0,0,0), softening=0.0):
+        super().__init__(mass, softening, center)
+
+
+class MiyamotoNagai:
+    # Flattened disk in the xy plane: scale length a, scale height b
+
+    def __init__(self, mass, a, b, center=(0,0,0)):
+        self.mass = mass
+        self.a = a
+        self.b = b
+        self.center = np.array(center, dtype=float)
+
+    def potential(self, pos, G):
+        x, y, z = (pos - self.center).T
+        zeta = np.sqrt(z**2 + self.b**2)
+        return -G*self.mass/np.sqrt(x**2 + y**2 + (self.a + zeta)**2)
+
+    def acceleration(self, pos, G):
+        x, y, z = (pos - self.center).T
+        zeta = np.sqrt(z**2 + self.b**2)
+        D3 = (x**2 + y**2 + (self.a + zeta)**2)**1.5
+        k = -G*self.mass/D3
+        az = np.zeros_like(z)
+        np.divide(k*z*(self.a + zeta), zeta, out=az, where=zeta > 0)
+        return np.column_stack([k*x, k*y, az])
+
+
+class Callable:
+    # Any f(positions, G) -> (n, 3) accelerations, with an optional matching
+    # potential function; the energy escape criterion needs one
+
+    def __init__(self, acceleration, potential=None):
+        if not callable(acceleration) or (potential is not None and not callable(potential)):
+            raise TypeError("Callable potentials need functions f(positions, G)")
+        self.function = acceleration
+        self.potential_function = potential
+
+    @property
+    def has_potential(self):
+        return self.potential_function is not None
+
+    def potential(self, pos, G):
+        if not self.has_potential:
+            raise TypeError("This external field was given without a potential function")
+        return self.potential_function(pos, G)
+
+    def acceleration(self, pos, G):
+        return np.asarray(self.function(pos, G), dtype=float).reshape(-1, 3)
@@ -0,0 +1,10 @@
+# =============================================================================
+# Progress bars. tqdm is only imported once a bar is actually shown, so runs
+# with progress=False (ensemble workers, batch nodes) never load it.
+# =============================================================================
+
+def progress_bar(iterable, desc=None, total=None, disable=False):
+    if disable:
+        return iterable
+    from tqdm import tqdm
+    return tqdm(iterable, desc=desc, total=total)
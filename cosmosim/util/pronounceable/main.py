@@ -3,6 +3,7 @@ try:
     from secrets import choice
 except ImportError:
     from random import randrange, choice
+from random import Random
 
 from ..pronounceable.digraph import DIGRAPHS_FREQUENCY
 from ..pronounceable.components import INITIAL_CONSONANTS, FINAL_CONSONANTS, double_vowels
@@ -104,5 +105,24 @@ def generate_word():
     return choice(INITIAL_CONSONANTS) + choice(choice(['aeiouy', list(double_vowels())])) + choice(['', choice(FINAL_CONSONANTS)])
 
 
+# Sorted copies of the consonant tables: the originals are built from sets, so
+# their order changes from one interpreter to the next
+_INITIAL_CONSONANTS = sorted(INITIAL_CONSONANTS)
+_FINAL_CONSONANTS = sorted(FINAL_CONSONANTS)
+_DOUBLE_VOWELS = list(double_vowels())
+
+
+def word_from_id(word_id, seed=0):
+    """
+    Same kind of word as generate_word, but always the same one for a given
+    id and seed
+    :return: str
+    >>> word_from_id(42)
+    """
+    rng = Random(f"{seed}:{word_id}")
+    vowels = rng.choice(['aeiouy', _DOUBLE_VOWELS])
+    return rng.choice(_INITIAL_CONSONANTS) + rng.choice(vowels) + rng.choice(['', rng.choice(_FINAL_CONSONANTS)])
+
+
 if __name__ == '__main__':
     pass
\ No newline at end of file
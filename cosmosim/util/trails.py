@@ -0,0 +1,70 @@
+import numpy as np
+import cosmosim.util.functions as F
+
+# =============================================================================
+# Orbit trails. The last `length` positions of every body live in one
+# preallocated (bodies, length, dims) ring buffer, indexed by a slot per body
+# (its index or id). All bodies are recorded together, so a single write
+# position serves the whole buffer. Drawing projects every trail point in one
+# call and draws each trail as a few polylines that fade towards its tail.
+# =============================================================================
+
+class Trails:
+
+    def __init__(self, length=1000, dims=2, capacity=0, bands=4):
+        self.length = length
+        self.dims = dims
+        self.bands = bands      # Brightness steps along a trail
+        self.points = np.zeros((capacity, length, dims))
+        self.count = np.zeros(capacity, dtype=int)
+        self.head = 0
+
+    def reserve(self, capacity):
+        # Grow to hold slots up to capacity - 1
+        extra = capacity - len(self.count)
+        if extra > 0:
+            self.points = np.concatenate([self.points, np.zeros((extra, self.length, self.dims))])
+            self.count = np.concatenate([self.count, np.zeros(extra, dtype=int)])
+
+    def reset(self):
+        self.count[:] = 0
+
+    def record(self, slots, positions):
+        # Append one point to each given slot's trail; trails of the slots
+        # left out are cleared
+        slots = np.asarray(slots, dtype=int)
+        if slots.size:
+            self.reserve(slots.max() + 1)
+            self.points[slots, self.head] = np.asarray(positions)[:, :self.dims]
+        present = np.zeros(len(self.count), dtype=bool)
+        present[slots] = True
+        self.count[~present] = 0
+        self.count[slots] = np.minimum(self.count[slots] + 1, self.length)
+        self.head = (self.head + 1) % self.length
+
+    def screen_points(self, slots, camera):
+        # Oldest to newest screen coordinates of each slot's trail
+        slots = np.asarray(slots, dtype=int)
+        slots = slots[slots < len(self.count)]
+        slots = slots[self.count[slots] > 1]
+        # Roll so that the oldest point comes first
+        order = (self.head + np.arange(self.length)) % self.length
+        q = F.project(self.points[slots][:, order].reshape(-1, self.dims), camera)
+        q = q.reshape(len(slots), self.length, 2)
+        return [(slot, q[k, self.length - self.count[slot]:])
+                for k, slot in enumerate(slots)]
+
+    def draw(self, screen, camera, slots, colors):
+        # colors: one RGB color per slot
+        import pygame
+        colors = dict(zip(np.asarray(slots, dtype=int).tolist(), np.asarray(colors).tolist()))
+        for slot, q in self.screen_points(slots, camera):
+            # Split into bands of increasing brightness, overlapping by a
+            # point so the polyline stays connected
+            edges = np.linspace(0, len(q) - 1, min(self.bands, len(q) - 1) + 1).astype(int)
+            for b in range(len(edges) - 1):
+                alpha = (b + 1)/(len(edges) - 1)
+                color = tuple(alpha*c for c in colors[int(slot)])
+                segment = q[edges[b]:edges[b+1] + 1].astype(int).tolist()
+                if len(segment) > 1:
+                    pygame.draw.lines(screen, color, False, segment, 1)
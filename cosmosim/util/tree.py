@@ -0,0 +1,165 @@
+import numpy as np
+from cosmosim.util.morton import BITS, morton_keys
+
+# =============================================================================
+# Barnes-Hut forces on a linear octree. Bodies are sorted by Morton key, so
+# every node is a contiguous range of the sorted bodies and the tree is just
+# a few arrays per level.
+#
+# Bodies move only a little per step, so the tree's topology is kept from
+# step to step and only refit: each node's mass, centre of mass and radius
+# (the largest distance of a member from that centre) are recomputed from
+# the current positions in O(n * depth). The opening test uses the refit
+# radius, so forces stay correct as the nodes loosen. The tree is rebuilt
+# once the leaves have grown by more than max_growth on average, every
+# rebuild_every steps, or when the bodies change.
+# =============================================================================
+
+def _expand(starts, counts):
+    # Concatenated ranges [start, start + count)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.arange(counts.sum()) - offsets + np.repeat(starts, counts)
+
+def _reduce(values, starts, op=np.add):
+    # Reduce the consecutive runs of values beginning at starts
+    if len(starts) == 0:
+        return np.zeros((0,) + values.shape[1:])
+    return op.reduceat(values, starts, axis=0)
+
+
+class Octree:
+
+    def __init__(self, theta=0.5, leaf_size=16, rebuild_every=20,
+                 max_growth=1.5, tile=4096):
+        self.theta = theta
+        self.leaf_size = leaf_size
+        self.rebuild_every = rebuild_every
+        self.max_growth = max_growth
+        self.tile = tile
+        self.n = None
+        self.builds = 0
+
+    def invalidate(self):
+        self.n = None
+
+    def build(self, p):
+        n = len(p)
+        keys = morton_keys(p)
+        self.order = np.argsort(keys, kind="stable")
+        keys = keys[self.order]
+        # Nodes, breadth first: body range [start, end) in sorted order, and
+        # the range of their children among the nodes
+        start, end = [np.array([0])], [np.array([n])]
+        first_child, n_children = [], []
+        # Per level: node ids and the sorted bodies they cover, for refits
+        self.levels = []
+        level_start, level_end, base = start[0], end[0], 0
+        for level in range(BITS + 1):
+            ids = base + np.arange(len(level_start))
+            counts = level_end - level_start
+            self.levels.append((ids, _expand(level_start, counts),
+                                np.cumsum(counts) - counts))
+            split = (counts > self.leaf_size) & (level < BITS)
+            children_start, children_end = np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+            if split.any():
+                # Children are the runs of equal key prefix inside a split node
+                members = _expand(level_start[split], counts[split])
+                prefix = keys[members] >> np.uint64(3*(BITS - level - 1))
+                breaks = np.flatnonzero(np.r_[True, prefix[1:] != prefix[:-1]])
+                children_start = members[breaks]
+                children_end = np.r_[members[breaks[1:] - 1] + 1, members[-1] + 1]
+            parent = np.searchsorted(level_start, children_start, side="right") - 1
+            per_node = np.bincount(parent, minlength=len(level_start))
+            base += len(level_start)
+            first_child.append(base + np.cumsum(per_node) - per_node)
+            n_children.append(per_node)
+            if children_start.size == 0:
+                break
+            start.append(children_start)
+            end.append(children_end)
+            level_start, level_end = children_start, children_end
+        self.start = np.concatenate(start)
+        self.end = np.concatenate(end)
+        self.first_child = np.concatenate(first_child)
+        self.n_children = np.concatenate(n_children)
+        self.leaf = self.n_children == 0
+        self.n = n
+        self.age = 0
+        self.builds += 1
+
+    def refit(self, p, m):
+        ps, ms = p[self.order], m[self.order]
+        nodes = len(self.start)
+        self.mass = np.zeros(nodes)
+        self.com = np.zeros((nodes, 3))
+        self.radius = np.zeros(nodes)
+        for ids, bodies, offsets in self.levels:
+            mass = _reduce(ms[bodies], offsets)
+            moment = _reduce(ms[bodies, None]*ps[bodies], offsets)
+            # Massless nodes sit at the middle of their bodies
+            mean = _reduce(ps[bodies], offsets)/np.diff(np.r_[offsets, bodies.size])[:,None]
+            com = np.where(mass[:,None] > 0, moment/np.where(mass > 0, mass, 1)[:,None], mean)
+            node = np.repeat(np.arange(len(ids)), np.diff(np.r_[offsets, bodies.size]))
+            d = ps[bodies] - com[node]
+            self.mass[ids] = mass
+            self.com[ids] = com
+            self.radius[ids] = _reduce(np.sqrt(np.sum(d*d, axis=1)), offsets, np.maximum)
+
+    def update(self, p, m):
+        # Refit the current tree, or rebuild it if it no longer fits
+        if self.n != len(p) or (self.rebuild_every and self.age >= self.rebuild_every):
+            self.build(p)
+            self.refit(p, m)
+            self.built_radius = self.radius[self.leaf].sum()
+            return
+        self.refit(p, m)
+        self.age += 1
+        if self.radius[self.leaf].sum() > self.max_growth*max(self.built_radius, np.finfo(float).tiny):
+            self.build(p)
+            self.refit(p, m)
+            self.built_radius = self.radius[self.leaf].sum()
+
+    def accelerations(self, p, m, G=1):
+        self.update(p, m)
+        n = len(p)
+        out = np.zeros((n, 3))
+        sorted_p, sorted_m = p[self.order], m[self.order]
+        theta2 = self.theta**2
+        for tile in range(0, n, self.tile):
+            # Frontier of (target, node) pairs still to be resolved; targets
+            # are taken in key order so that a tile walks the same nodes
+            target = self.order[tile:tile + self.tile]
+            node = np.zeros(target.size, dtype=int)
+            while target.size:
+                d = self.com[node] - p[target]
+                r2 = np.sum(d*d, axis=1)
+                far = self.radius[node]**2 < theta2*r2
+                # Distant nodes act as a point mass at their centre of mass
+                self._add(out, target[far], self.mass[node[far]], d[far], r2[far])
+                # Near leaves are summed body by body
+                near_leaf = ~far & self.leaf[node]
+                counts = self.end[node[near_leaf]] - self.start[node[near_leaf]]
+                source = _expand(self.start[node[near_leaf]], counts)
+                pair_target = np.repeat(target[near_leaf], counts)
+                ds = sorted_p[source] - p[pair_target]
+                self._add(out, pair_target, sorted_m[source], ds, np.sum(ds*ds, axis=1))
+                # Near internal nodes are opened
+                opened = ~far & ~self.leaf[node]
+                counts = self.n_children[node[opened]]
+                target = np.repeat(target[opened], counts)
+                node = _expand(self.first_child[node[opened]], counts)
+        return G*out
+
+    @staticmethod
+    def _add(out, target, mass, d, r2):
+        # Coincident pairs (including each body with itself) don't interact
+        inv_r3 = np.zeros_like(r2)
+        np.divide(1.0, r2*np.sqrt(r2), out=inv_r3, where=r2 > 0)
+        w = mass*inv_r3
+        for k in range(3):
+            out[:,k] += np.bincount(target, weights=w*d[:,k], minlength=len(out))
+
+
+def acc_tree(pos, mas, G=1, **options):
+    # One-off Barnes-Hut evaluation; a State keeps its Octree between steps
+    return Octree(**options).accelerations(pos, mas, G)
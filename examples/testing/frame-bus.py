@@ -0,0 +1,40 @@
+import multiprocessing
+from cosmosim.core.universe import Universe
+from cosmosim.core.initial_conditions import uniform_sphere
+from cosmosim.core.framebus import FrameBus
+from cosmosim.core.ensemble import bodies, total_mass, momentum
+
+AU = 1.496e11       # Astronomical unit
+ME = 5.972e24       # Mass of the Earth
+
+# =============================================================================
+# A run publishing its frames to shared memory while a separate process
+# samples metrics from them. The player can watch the same run from another
+# terminal while it goes:
+#
+#   InteractiveAnimation(FrameBus.attach("cosmosim-demo")).play()
+# =============================================================================
+
+NAME = "cosmosim-demo"
+NUM_BODIES = 5000
+METRICS = {"bodies": bodies, "total_mass": total_mass, "momentum": momentum}
+
+def sampler(name, every=10):
+    bus = FrameBus.attach(name)
+    for frame in bus.frames():
+        if frame.iteration % every == 0:
+            values = {metric: f(frame) for metric, f in METRICS.items()}
+            if frame.valid():
+                print(frame.iteration, values)
+    bus.close()
+
+if __name__ == '__main__':
+    sim = Universe([], dt=1e5, iterations=500, seed=42, force="tree")
+    uniform_sphere(sim.state, n=NUM_BODIES, radius=50*AU, mass=(0.1*ME, 10*ME),
+                   density=4000, velocity_dispersion=1e3)
+    sim.bus = FrameBus(NAME, capacity=len(sim.state))
+    reader = multiprocessing.Process(target=sampler, args=(NAME,))
+    reader.start()
+    sim.run(record=False)
+    sim.bus.close()
+    reader.join()
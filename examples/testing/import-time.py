@@ -0,0 +1,19 @@
+from cosmosim.core.headless import import_time, check_imports, IMPORT_BUDGET
+
+# Cold import cost of each module, best of five fresh interpreters
+MODULES = [
+    "numpy",
+    "cosmosim.core.universe",
+    "cosmosim.core.ensemble",
+    "cosmosim.core.trajectory",
+    "cosmosim.core.animation",
+]
+
+for module in MODULES:
+    seconds, loaded = import_time(module)
+    extra = f" (loaded {', '.join(loaded)})" if loaded else ""
+    print(f"{module:<28} {1000*seconds:7.1f} ms{extra}")
+
+# Fails if the simulation core goes over budget or loads a display module
+check_imports(IMPORT_BUDGET)
+print(f"Within the {1000*IMPORT_BUDGET:.0f} ms budget")
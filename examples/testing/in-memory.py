@@ -1,6 +1,6 @@
 from cosmosim.core.universe import Object, Universe
 from cosmosim.core.animation import InteractiveAnimation
-import random
+from cosmosim.core.initial_conditions import keplerian_disk
 
 AU = 1.496e11   # Astronomical unit
 ME = 5.972e24   # Mass of the Earth
@@ -30,21 +30,19 @@ D_MAX = 2*AU
 MIN_MASS = 0.1*ME
 MAX_MASS = 100*ME
 
-planets = []
-for i in range(NUM_PLANETS):
-    PLANET_DISTANCE = random.randint(D_MIN, D_MAX)
-    PLANET_MASS = random.randint(MIN_MASS, MAX_MASS)
-    p = star.create_satellite(distance=PLANET_DISTANCE,
-                              mass=PLANET_MASS,
-                              density=PLANET_DENSITY)
-    planets.append(p)
-   
 #Simulate
+SEED = 42
 iterations = 1000
 dt = 60
-objects = [star, *planets]
 
-test_sim = Universe(objects, dt, iterations)
+test_sim = Universe([star], dt, iterations, seed=SEED)
+keplerian_disk(test_sim.state, 
+               n=NUM_PLANETS, 
+               central_mass=STAR_MASS,
+               r_min=D_MIN, 
+               r_max=D_MAX, 
+               mass=(MIN_MASS, MAX_MASS),
+               density=PLANET_DENSITY)
 data = test_sim.run()
 
 scale=2e-9
@@ -2,5 +2,5 @@ from cosmosim.core.animation import InteractiveAnimation
 scale=6.5e-9
 path = "C:/test_data/cosmosim/test_run/"
 
-animation = InteractiveAnimation(path, scale=scale)
+animation = InteractiveAnimation(path, scale=scale, lazy=True)
 animation.play(paused=True)
\ No newline at end of file
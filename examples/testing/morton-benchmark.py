@@ -0,0 +1,45 @@
+import time
+from cosmosim.core.universe import Universe
+from cosmosim.core.initial_conditions import uniform_sphere
+
+AU = 1.496e11       # Astronomical unit
+ME = 5.972e24       # Mass of the Earth
+
+# =============================================================================
+# Step time of a large cloud with bodies in creation (random) order against
+# the same cloud periodically sorted along a Morton curve. P3M forces and 
+# collisions both walk neighbors in space. Only the P3M short-range pair
+# sum was measured faster sorted (~10%); whole steps come out the same.
+#
+# The mesh is refined with n to keep about eight cells per body inside the
+# cloud. The direct part of P3M then sees ~100 neighbors per body. With a
+# fixed grid this grows with n, to tens of GB at 200k bodies.
+# =============================================================================
+
+SIZES = [10000, 50000, 100000]
+STEPS = 10
+WARMUP = 2
+REORDER_EVERY = 10
+
+def grid(n):
+    # The cloud fills about half of the mesh's cube
+    return int(2.5*n**(1/3)) + 5
+
+def step_time(n, reorder_every):
+    sim = Universe([], dt=1e5, iterations=STEPS, seed=42, force="pm",
+                   force_options={"grid": grid(n), "p3m": True},
+                   reorder_every=reorder_every)
+    uniform_sphere(sim.state, n=n, radius=50*AU, mass=(0.1*ME, 10*ME),
+                   density=4000, velocity_dispersion=1e3)
+    if reorder_every:
+        sim.state.reorder()
+    sim.step(WARMUP)
+    start = time.perf_counter()
+    sim.step(STEPS)
+    return (time.perf_counter() - start)/STEPS
+
+print(f"{'bodies':>8} {'creation order':>16} {'Morton order':>14} {'speedup':>8}")
+for n in SIZES:
+    plain = step_time(n, 0)
+    sorted_ = step_time(n, REORDER_EVERY)
+    print(f"{n:>8} {1000*plain:>13.1f} ms {1000*sorted_:>11.1f} ms {plain/sorted_:>7.2f}x")
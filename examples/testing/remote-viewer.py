@@ -0,0 +1,18 @@
+from cosmosim.core.animation import InteractiveAnimation
+
+# =============================================================================
+# Watching a run on another machine. On the compute node, run frame-bus.py
+# (or any run with a FrameBus) and serve its frames:
+#
+#   python -m cosmosim.core.stream cosmosim-demo 127.0.0.1:8765
+#
+# then forward the port to the workstation and play from there:
+#
+#   ssh -L 8765:127.0.0.1:8765 <node>
+# =============================================================================
+
+scale = 6.5e-9
+address = "tcp://127.0.0.1:8765"
+
+animation = InteractiveAnimation(address, scale=scale)
+animation.play()